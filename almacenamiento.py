@@ -0,0 +1,31 @@
+# almacenamiento.py
+# Almacenamiento opcional de comprobantes fuera de la base de datos.
+#
+# Con COMPROBANTES_STORAGE_DIR definido, los blobs (ya comprimidos) se
+# escriben como archivos bajo una clave aleatoria y la base guarda solo
+# esa clave: las filas calientes quedan angostas y backups/replicación
+# dejan de arrastrar megabytes de adjuntos. Sin la variable definida no
+# cambia nada y los blobs siguen en la base, como siempre.
+import os
+import uuid
+
+_DIRECTORIO = os.environ.get('COMPROBANTES_STORAGE_DIR')
+
+
+def habilitado():
+    """True si el deployment definió un directorio para comprobantes"""
+    return bool(_DIRECTORIO)
+
+
+def guardar(blob):
+    """Escribe el blob y devuelve la clave para recuperarlo después"""
+    clave = uuid.uuid4().hex
+    with open(os.path.join(_DIRECTORIO, clave), 'wb') as destino:
+        destino.write(blob)
+    return clave
+
+
+def leer(clave):
+    """Lee el blob guardado bajo la clave dada"""
+    with open(os.path.join(_DIRECTORIO, clave), 'rb') as origen:
+        return origen.read()
@@ -1,1348 +1,1740 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
-from functools import wraps
-from datetime import datetime, date, time, timedelta
-from sqlalchemy import func, and_, or_
-import gzip
-import io
-import os
-
-
-from config import Config
-from models import (db, Usuario, GrupoFamiliar, Especialidad, Turno, Pago, 
-                   Movimiento, HorarioDisponible, RolUsuario, EstadoTurno, 
-                   EstadoPago, TipoMovimiento)
-from admin_routes import admin_bp
-from models_admin import EspecialistaEspecialidad
-from turno_generator import GeneradorTurnos
-from prepaga_routes import prepaga_bp
-from models_prepaga import (SuscripcionPrepaga, EstadoSuscripcion, 
-                            HistorialConsultasPrepaga, PagoMensualPrepaga, EstadoPagoMensual)
-
-app = Flask(__name__)
-app.config.from_object(Config)
-
-db.init_app(app)
-
-# Registrar Blueprint de administración
-app.register_blueprint(admin_bp)
-app.register_blueprint(prepaga_bp)
-
-# ==================== DECORADORES ====================
-
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Debe iniciar sesión para acceder a esta página', 'warning')
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
-
-def role_required(*roles):
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                flash('Debe iniciar sesión', 'warning')
-                return redirect(url_for('login'))
-            
-            usuario = Usuario.query.get(session['user_id'])
-            if not usuario or usuario.rol not in roles:
-                flash('No tiene permisos para acceder a esta página', 'danger')
-                return redirect(url_for('index'))
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
-# ==================== UTILIDADES ====================
-
-def comprimir_archivo(archivo_bytes):
-    """Comprime un archivo usando gzip"""
-    return gzip.compress(archivo_bytes)
-
-def descomprimir_archivo(archivo_comprimido):
-    """Descomprime un archivo gzip"""
-    return gzip.decompress(archivo_comprimido)
-
-def allowed_file(filename):
-    """Verifica si el archivo tiene una extensión permitida"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-
-def calcular_costo_grupo_familiar(usuario_id):
-    """Calcula el costo con descuento por grupo familiar"""
-    cant_familiares = GrupoFamiliar.query.filter_by(
-        usuario_id=usuario_id, 
-        activo=True
-    ).count()
-    
-    costo_base = app.config['COSTO_BASE_CONSULTA']
-    descuento = app.config['DESCUENTO_GRUPO_FAMILIAR']
-    
-    if cant_familiares == 0:
-        return costo_base
-    
-    descuento_total = descuento * cant_familiares
-    if descuento_total > 0.5:  # Máximo 50% descuento
-        descuento_total = 0.5
-    
-    return costo_base * (1 - descuento_total)
-
-# ==================== RUTAS PÚBLICAS ====================
-
-@app.route('/')
-def index():
-    especialidades = Especialidad.query.filter_by(activo=True).all()
-    
-    # Calcular costo simulado para vista previa
-    costo_base = app.config['COSTO_BASE_CONSULTA']
-    
-    return render_template('index.html', 
-                         especialidades=especialidades,
-                         costo_base=costo_base)
-
-@app.route('/simular-costo', methods=['POST'])
-def simular_costo():
-    """Simula el costo según cantidad de familiares"""
-    cant_familiares = int(request.form.get('cant_familiares', 0))
-    
-    costo_base = app.config['COSTO_BASE_CONSULTA']
-    descuento = app.config['DESCUENTO_GRUPO_FAMILIAR']
-    
-    descuento_total = descuento * cant_familiares
-    if descuento_total > 0.5:
-        descuento_total = 0.5
-    
-    costo_final = costo_base * (1 - descuento_total)
-    ahorro = costo_base - costo_final
-    
-    return render_template('simulador_result.html',
-                         costo_base=costo_base,
-                         cant_familiares=cant_familiares,
-                         descuento_pct=descuento_total * 100,
-                         costo_final=costo_final,
-                         ahorro=ahorro)
-
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    if request.method == 'POST':
-        try:
-            # Datos del usuario
-            nombre = request.form.get('nombre')
-            apellido = request.form.get('apellido')
-            dni = request.form.get('dni')
-            email = request.form.get('email')
-            telefono = request.form.get('telefono')
-            password = request.form.get('password')
-            password_confirm = request.form.get('password_confirm')
-            
-            # Validaciones
-            if password != password_confirm:
-                flash('Las contraseñas no coinciden', 'danger')
-                return redirect(url_for('register'))
-            
-            if Usuario.query.filter_by(dni=dni).first():
-                flash('El DNI ya está registrado', 'danger')
-                return redirect(url_for('register'))
-            
-            if Usuario.query.filter_by(email=email).first():
-                flash('El email ya está registrado', 'danger')
-                return redirect(url_for('register'))
-            
-            # Crear usuario
-            usuario = Usuario(
-                nombre=nombre,
-                apellido=apellido,
-                dni=dni,
-                email=email,
-                telefono=telefono,
-                rol=RolUsuario.PACIENTE
-            )
-            usuario.set_password(password)
-            
-            db.session.add(usuario)
-            db.session.flush()  # Para obtener el ID
-            
-            # Grupo familiar (opcional)
-            familiares_nombres = request.form.getlist('familiar_nombre[]')
-            familiares_apellidos = request.form.getlist('familiar_apellido[]')
-            familiares_dnis = request.form.getlist('familiar_dni[]')
-            familiares_parentescos = request.form.getlist('familiar_parentesco[]')
-            
-            for i in range(len(familiares_nombres)):
-                if familiares_nombres[i] and familiares_dnis[i]:
-                    familiar = GrupoFamiliar(
-                        usuario_id=usuario.id,
-                        nombre=familiares_nombres[i],
-                        apellido=familiares_apellidos[i],
-                        dni=familiares_dnis[i],
-                        parentesco=familiares_parentescos[i]
-                    )
-                    db.session.add(familiar)
-            
-            db.session.commit()
-            
-            flash('Registro exitoso. Ya puede iniciar sesión', 'success')
-            return redirect(url_for('login'))
-            
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al registrar: {str(e)}', 'danger')
-            return redirect(url_for('register'))
-    
-    return render_template('register.html')
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        dni = request.form.get('dni')
-        password = request.form.get('password')
-        
-        usuario = Usuario.query.filter_by(dni=dni, activo=True).first()
-        
-        if usuario and usuario.check_password(password):
-            session.permanent = True
-            session['user_id'] = usuario.id
-            session['user_rol'] = usuario.rol.value
-            session['user_nombre'] = f"{usuario.nombre} {usuario.apellido}"
-            
-            flash(f'Bienvenido/a {usuario.nombre}', 'success')
-            
-            # Redireccionar según rol
-            if usuario.rol == RolUsuario.ADMIN or usuario.rol == RolUsuario.RECEPCION:
-                return redirect(url_for('dashboard_admin'))
-            elif usuario.rol == RolUsuario.ESPECIALISTA:
-                return redirect(url_for('dashboard_especialista'))
-            else:
-                return redirect(url_for('dashboard_user'))
-        else:
-            flash('DNI o contraseña incorrectos', 'danger')
-    
-    return render_template('login.html')
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    flash('Sesión cerrada correctamente', 'info')
-    return redirect(url_for('index'))
-
-# ==================== RUTAS USUARIO ====================
-
-# @app.route('/dashboard')
-# @login_required
-# def dashboard_user():
-#     usuario = Usuario.query.get(session['user_id'])
-    
-#     # Turnos próximos
-#     turnos_proximos = Turno.query.filter(
-#         Turno.paciente_id == usuario.id,
-#         Turno.fecha >= date.today(),
-#         Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-#     ).order_by(Turno.fecha, Turno.hora).limit(5).all()
-    
-#     # Pagos pendientes
-#     pagos_pendientes = Pago.query.join(Turno).filter(
-#         Turno.paciente_id == usuario.id,
-#         Pago.estado == EstadoPago.PENDIENTE
-#     ).all()
-    
-#     # Grupo familiar
-#     grupo_familiar = GrupoFamiliar.query.filter_by(
-#         usuario_id=usuario.id,
-#         activo=True
-#     ).all()
-    
-#     return render_template('dashboard_user.html',
-#                          usuario=usuario,
-#                          turnos_proximos=turnos_proximos,
-#                          pagos_pendientes=pagos_pendientes,
-#                          grupo_familiar=grupo_familiar)
-
-# ==================== TURNOS ====================
-# @app.route('/turnos/nuevo', methods=['GET', 'POST'])
-# @login_required
-# def nuevo_turno():
-#     if request.method == 'POST':
-#         # 1. Capturamos los datos del formulario (incluyendo el nuevo especialista_id)
-#         especialidad_id = request.form.get('especialidad_id')
-#         especialista_id = request.form.get('especialista_id')  # <--- AGREGAR ESTA LÍNEA
-#         familiar_id = request.form.get('familiar_id')
-#         fecha_str = request.form.get('fecha')
-#         hora = request.form.get('hora')
-#         motivo_consulta = request.form.get('motivo_consulta')
-
-#         try:
-#             # 2. Creamos la instancia del Turno
-#             nuevo_turno = Turno(
-#                 paciente_id=session['user_id'],
-#                 especialista_id=int(especialista_id), # <--- ASIGNAR EL ID AQUÍ
-#                 especialidad_id=int(especialidad_id),
-#                 familiar_id=int(familiar_id) if familiar_id else None,
-#                 fecha=datetime.strptime(fecha_str, '%Y-%m-%d').date(),
-#                 hora=hora,
-#                 motivo_consulta=motivo_consulta,
-#                 estado=EstadoTurno.PENDIENTE # O el estado inicial que uses
-#             )
-
-#             db.session.add(nuevo_turno)
-#             db.session.commit()
-            
-#             flash('¡Turno agendado con éxito!', 'success')
-#             return redirect(url_for('mis_turnos'))
-
-#         except Exception as e:
-#             db.session.rollback()
-#             flash(f'Error al agendar el turno: {str(e)}', 'danger')
-#             return redirect(url_for('nuevo_turno'))
-
-#     # Si es GET, cargamos las especialidades y familiares normalmente
-#     especialidades = Especialidad.query.all()
-#     grupo_familiar = GrupoFamiliar.query.filter_by(usuario_id=session['user_id']).all()
-#     return render_template('turnos_nuevo.html', 
-#                            especialidades=especialidades, 
-#                            grupo_familiar=grupo_familiar,
-#                            today=date.today().isoformat())
-
-# @app.route('/turnos/nuevo', methods=['GET', 'POST'])ESTE ES EL ULTIMO QUE FUNCIONA
-# @login_required
-# def nuevo_turno():
-#     if request.method == 'POST':
-#         try:
-#             # 1. Capturar todos los datos del formulario
-#             paciente_id = session['user_id']
-#             especialidad_id = request.form.get('especialidad_id')
-#             especialista_id = request.form.get('especialista_id')  # ID del especialista seleccionado
-#             familiar_id = request.form.get('familiar_id')  # Opcional
-#             fecha_str = request.form.get('fecha')
-#             hora_str = request.form.get('hora')
-#             motivo_consulta = request.form.get('motivo_consulta')
-            
-#             # 2. Validaciones básicas
-#             if not all([especialidad_id, especialista_id, fecha_str, hora_str]):
-#                 flash('Por favor complete todos los campos obligatorios', 'danger')
-#                 return redirect(url_for('nuevo_turno'))
-            
-#             # 3. Convertir fecha y hora
-#             fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-#             hora_turno = datetime.strptime(hora_str, '%H:%M').time()
-            
-#             # 4. Validar que no exista turno en ese horario para ese especialista
-#             turno_existente = Turno.query.filter_by(
-#                 especialista_id=int(especialista_id),
-#                 fecha=fecha_turno,
-#                 hora=hora_turno,
-#                 estado=EstadoTurno.PENDIENTE
-#             ).first()
-            
-#             if turno_existente:
-#                 flash('Ese horario ya está ocupado para este especialista', 'danger')
-#                 return redirect(url_for('nuevo_turno'))
-            
-#             # 5. Crear el turno
-#             nuevo_turno = Turno(
-#                 paciente_id=paciente_id,
-#                 especialista_id=int(especialista_id),
-#                 especialidad_id=int(especialidad_id),
-#                 familiar_id=int(familiar_id) if familiar_id else None,
-#                 fecha=fecha_turno,
-#                 hora=hora_turno,
-#                 motivo_consulta=motivo_consulta,
-#                 estado=EstadoTurno.PENDIENTE
-#             )
-            
-#             db.session.add(nuevo_turno)
-#             db.session.flush()  # Obtener el ID del turno sin hacer commit
-            
-#             # 6. Calcular costo con descuento por grupo familiar
-#             costo = calcular_costo_grupo_familiar(paciente_id)
-            
-#             # 7. Crear pago asociado automáticamente
-#             nuevo_pago = Pago(
-#                 turno_id=nuevo_turno.id,
-#                 monto=costo,
-#                 estado=EstadoPago.PENDIENTE
-#             )
-            
-#             db.session.add(nuevo_pago)
-#             db.session.commit()
-            
-#             flash('¡Turno agendado con éxito! Debe subir el comprobante de pago para confirmar.', 'success')
-#             return redirect(url_for('mis_turnos'))
-            
-#         except ValueError as ve:
-#             db.session.rollback()
-#             flash(f'Error en el formato de fecha u hora: {str(ve)}', 'danger')
-#             return redirect(url_for('nuevo_turno'))
-#         except Exception as e:
-#             db.session.rollback()
-#             flash(f'Error al crear turno: {str(e)}', 'danger')
-#             return redirect(url_for('nuevo_turno'))
-    
-#     # GET - Cargar datos para el formulario
-#     especialidades = Especialidad.query.filter_by(activo=True).all()
-#     grupo_familiar = GrupoFamiliar.query.filter_by(
-#         usuario_id=session['user_id'],
-#         activo=True
-#     ).all()
-    
-#     return render_template('turnos_nuevo.html',
-#                          especialidades=especialidades,
-#                          grupo_familiar=grupo_familiar,
-#                          today=date.today().isoformat())
-
-# @app.route('/turnos/nuevo', methods=['GET', 'POST'])
-# @login_required
-# def nuevo_turno():
-#     if request.method == 'POST':
-#         try:
-#             paciente_id = session['user_id']
-#             especialidad_id = request.form.get('especialidad_id')
-#             fecha_str = request.form.get('fecha')
-#             hora_str = request.form.get('hora')
-#             familiar_id = request.form.get('familiar_id')  # Opcional
-#             motivo = request.form.get('motivo_consulta')
-            
-#             # Convertir fecha y hora
-#             fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-#             hora_turno = datetime.strptime(hora_str, '%H:%M').time()
-            
-#             # Validar que no exista turno en ese horario
-#             turno_existente = Turno.query.filter_by(
-#                 especialidad_id=especialidad_id,
-#                 fecha=fecha_turno,
-#                 hora=hora_turno,
-#                 estado=EstadoTurno.PENDIENTE
-#             ).first()
-            
-#             if turno_existente:
-#                 flash('Ese horario ya está ocupado', 'danger')
-#                 return redirect(url_for('nuevo_turno'))
-            
-#             # Crear turno
-#             turno = Turno(
-#                 paciente_id=paciente_id,
-#                 especialidad_id=especialidad_id,
-#                 fecha=fecha_turno,
-#                 hora=hora_turno,
-#                 familiar_id=familiar_id if familiar_id else None,
-#                 motivo_consulta=motivo,
-#                 estado=EstadoTurno.PENDIENTE
-#             )
-            
-#             db.session.add(turno)
-#             db.session.flush()
-            
-#             # Crear pago asociado
-#             especialidad = Especialidad.query.get(especialidad_id)
-#             usuario = Usuario.query.get(paciente_id)
-            
-#             # Calcular costo con descuento por grupo familiar
-#             costo = calcular_costo_grupo_familiar(paciente_id)
-            
-#             pago = Pago(
-#                 turno_id=turno.id,
-#                 monto=costo,
-#                 estado=EstadoPago.PENDIENTE
-#             )
-            
-#             db.session.add(pago)
-#             db.session.commit()
-            
-#             flash('Turno solicitado correctamente. Debe abonar para confirmar.', 'success')
-#             return redirect(url_for('mis_turnos'))
-            
-#         except Exception as e:
-#             db.session.rollback()
-#             flash(f'Error al crear turno: {str(e)}', 'danger')
-#             return redirect(url_for('nuevo_turno'))
-    
-#     # GET
-#     especialidades = Especialidad.query.filter_by(activo=True).all()
-#     grupo_familiar = GrupoFamiliar.query.filter_by(
-#         usuario_id=session['user_id'],
-#         activo=True
-#     ).all()
-    
-#     return render_template('turnos_nuevo.html',
-#                          especialidades=especialidades,
-#                          grupo_familiar=grupo_familiar)
-
-# @app.route('/api/turnos/horarios-disponibles')
-# @login_required
-# def horarios_disponibles():
-#     """API para obtener horarios disponibles según especialidad y fecha"""
-#     especialidad_id = request.args.get('especialidad_id')
-#     fecha_str = request.args.get('fecha')
-    
-#     if not especialidad_id or not fecha_str:
-#         return {'error': 'Faltan parámetros'}, 400
-    
-#     fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-#     dia_semana = fecha.weekday()
-    
-#     # Obtener horarios configurados para ese día
-#     especialidad = Especialidad.query.get(especialidad_id)
-#     duracion = especialidad.duracion_turno
-    
-#     # Horarios genéricos (8:00 a 18:00, cada 30 min por defecto)
-#     horarios = []
-#     hora_inicio = time(8, 0)
-#     hora_fin = time(18, 0)
-    
-#     hora_actual = datetime.combine(date.today(), hora_inicio)
-#     hora_final = datetime.combine(date.today(), hora_fin)
-    
-#     while hora_actual < hora_final:
-#         horarios.append(hora_actual.time().strftime('%H:%M'))
-#         hora_actual += timedelta(minutes=duracion)
-    
-#     # Filtrar horarios ocupados
-#     turnos_ocupados = Turno.query.filter(
-#         Turno.especialidad_id == especialidad_id,
-#         Turno.fecha == fecha,
-#         Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-#     ).all()
-    
-#     horarios_ocupados = [t.hora.strftime('%H:%M') for t in turnos_ocupados]
-#     horarios_disponibles = [h for h in horarios if h not in horarios_ocupados]
-    
-#     return {'horarios': horarios_disponibles}
-
-@app.route('/turnos/nuevo', methods=['GET', 'POST'])
-@login_required
-def nuevo_turno():
-    if request.method == 'POST':
-        try:
-            # 1. Capturar todos los datos del formulario
-            paciente_id = session['user_id']
-            especialidad_id = request.form.get('especialidad_id')
-            especialista_id = request.form.get('especialista_id')
-            familiar_id = request.form.get('familiar_id')
-            fecha_str = request.form.get('fecha')
-            hora_str = request.form.get('hora')
-            motivo_consulta = request.form.get('motivo_consulta')
-            
-            # 2. Validaciones básicas
-            if not all([especialidad_id, especialista_id, fecha_str, hora_str]):
-                flash('Por favor complete todos los campos obligatorios', 'danger')
-                return redirect(url_for('nuevo_turno'))
-            
-            # 3. Convertir fecha y hora
-            fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-            hora_turno = datetime.strptime(hora_str, '%H:%M').time()
-            
-            # 4. Validar que no exista turno en ese horario para ese especialista
-            turno_existente = Turno.query.filter_by(
-                especialista_id=int(especialista_id),
-                fecha=fecha_turno,
-                hora=hora_turno,
-                estado=EstadoTurno.PENDIENTE
-            ).first()
-            
-            if turno_existente:
-                flash('Ese horario ya está ocupado para este especialista', 'danger')
-                return redirect(url_for('nuevo_turno'))
-            
-            # 5. Verificar si el usuario tiene suscripción de prepaga activa
-            suscripcion = SuscripcionPrepaga.query.filter_by(
-                usuario_id=paciente_id,
-                estado=EstadoSuscripcion.ACTIVA
-            ).first()
-            
-            # 6. Crear el turno
-            nuevo_turno = Turno(
-                paciente_id=paciente_id,
-                especialista_id=int(especialista_id),
-                especialidad_id=int(especialidad_id),
-                familiar_id=int(familiar_id) if familiar_id else None,
-                fecha=fecha_turno,
-                hora=hora_turno,
-                motivo_consulta=motivo_consulta,
-                estado=EstadoTurno.PENDIENTE
-            )
-            
-            db.session.add(nuevo_turno)
-            db.session.flush()  # Obtener el ID del turno
-            
-            # 7. Procesar según tenga o no prepaga
-            if suscripcion and suscripcion.tiene_consultas_disponibles():
-                # ✅ TIENE PREPAGA CON CONSULTAS DISPONIBLES
-                
-                # Consumir consulta
-                consultas_antes = suscripcion.consultas_restantes()
-                suscripcion.consumir_consulta()
-                consultas_despues = suscripcion.consultas_restantes()
-                
-                # Registrar en historial
-                historial = HistorialConsultasPrepaga(
-                    suscripcion_id=suscripcion.id,
-                    turno_id=nuevo_turno.id,
-                    consultas_antes=consultas_antes,
-                    consultas_despues=consultas_despues
-                )
-                db.session.add(historial)
-                
-                # El turno se confirma automáticamente (sin necesidad de pago)
-                nuevo_turno.estado = EstadoTurno.CONFIRMADO
-                
-                db.session.commit()
-                
-                flash(f'¡Turno agendado con éxito! Consultas restantes: {consultas_despues}', 'success')
-                
-            else:
-                # ❌ NO TIENE PREPAGA O SE QUEDÓ SIN CONSULTAS
-                
-                # Calcular costo con descuento por grupo familiar
-                costo = calcular_costo_grupo_familiar(paciente_id)
-                
-                # Crear pago asociado
-                nuevo_pago = Pago(
-                    turno_id=nuevo_turno.id,
-                    monto=costo,
-                    estado=EstadoPago.PENDIENTE
-                )
-                
-                db.session.add(nuevo_pago)
-                db.session.commit()
-                
-                if suscripcion and not suscripcion.tiene_consultas_disponibles():
-                    flash('Se agotaron sus consultas de prepaga. Debe abonar esta consulta.', 'warning')
-                else:
-                    flash('Turno agendado. Debe subir el comprobante de pago para confirmar.', 'success')
-            
-            return redirect(url_for('mis_turnos'))
-            
-        except ValueError as ve:
-            db.session.rollback()
-            flash(f'Error en el formato de fecha u hora: {str(ve)}', 'danger')
-            return redirect(url_for('nuevo_turno'))
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al crear turno: {str(e)}', 'danger')
-            return redirect(url_for('nuevo_turno'))
-    
-    # GET - Cargar datos para el formulario
-    especialidades = Especialidad.query.filter_by(activo=True).all()
-    grupo_familiar = GrupoFamiliar.query.filter_by(
-        usuario_id=session['user_id'],
-        activo=True
-    ).all()
-    
-    # Obtener suscripción si existe
-    suscripcion = SuscripcionPrepaga.query.filter_by(
-        usuario_id=session['user_id'],
-        estado=EstadoSuscripcion.ACTIVA
-    ).first()
-    
-    return render_template('turnos_nuevo.html',
-                         especialidades=especialidades,
-                         grupo_familiar=grupo_familiar,
-                         suscripcion=suscripcion,
-                         today=date.today().isoformat())
-
-# AGREGAR ESTA NUEVA RUTA PARA EL DASHBOARD:
-
-@app.route('/dashboard')
-@login_required
-def dashboard_user():
-    usuario = Usuario.query.get(session['user_id'])
-    
-    # Turnos próximos
-    turnos_proximos = Turno.query.filter(
-        Turno.paciente_id == usuario.id,
-        Turno.fecha >= date.today(),
-        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-    ).order_by(Turno.fecha, Turno.hora).limit(5).all()
-    
-    # Pagos pendientes (solo si no tiene prepaga)
-    pagos_pendientes = Pago.query.join(Turno).filter(
-        Turno.paciente_id == usuario.id,
-        Pago.estado == EstadoPago.PENDIENTE
-    ).all()
-    
-    # Grupo familiar
-    grupo_familiar = GrupoFamiliar.query.filter_by(
-        usuario_id=usuario.id,
-        activo=True
-    ).all()
-    
-    # Suscripción de prepaga
-    suscripcion = SuscripcionPrepaga.query.filter_by(
-        usuario_id=usuario.id
-    ).filter(
-        SuscripcionPrepaga.estado.in_([EstadoSuscripcion.ACTIVA, EstadoSuscripcion.PENDIENTE])
-    ).first()
-    
-    # Pago mensual pendiente (si tiene prepaga)
-    pago_mensual_pendiente = None
-    if suscripcion and suscripcion.estado == EstadoSuscripcion.ACTIVA:
-        hoy = date.today()
-        pago_mensual_pendiente = PagoMensualPrepaga.query.filter_by(
-            suscripcion_id=suscripcion.id,
-            mes=hoy.month,
-            anio=hoy.year
-        ).filter(
-            PagoMensualPrepaga.estado.in_([EstadoPagoMensual.PENDIENTE, EstadoPagoMensual.RECHAZADO])
-        ).first()
-    
-    return render_template('dashboard_user.html',
-                         usuario=usuario,
-                         turnos_proximos=turnos_proximos,
-                         pagos_pendientes=pagos_pendientes,
-                         grupo_familiar=grupo_familiar,
-                         suscripcion=suscripcion,
-                         pago_mensual_pendiente=pago_mensual_pendiente)
-
-# ACTUALIZAR EL COMANDO seed_db() PARA INCLUIR PLANES:
-
-@app.cli.command()
-def seed_db():
-    """Carga datos de ejemplo incluyendo planes de prepaga"""
-    
-    # Admin
-    admin = Usuario(
-        nombre="Admin",
-        apellido="Sistema",
-        dni="00000000",
-        email="admin@consultorio.com",
-        telefono="1234567890",
-        rol=RolUsuario.ADMIN
-    )
-    admin.set_password("admin123")
-    db.session.add(admin)
-    
-    # Especialidades
-    especialidades = [
-        Especialidad(nombre="Clínica Médica", costo_consulta=15000, duracion_turno=30),
-        Especialidad(nombre="Pediatría", costo_consulta=15000, duracion_turno=30),
-        Especialidad(nombre="Cardiología", costo_consulta=20000, duracion_turno=45),
-        Especialidad(nombre="Dermatología", costo_consulta=18000, duracion_turno=30),
-    ]
-    
-    for esp in especialidades:
-        db.session.add(esp)
-    
-    # Planes de Prepaga
-    planes = [
-        PlanPrepaga(
-            tipo=TipoPlan.INDIVIDUAL,
-            nombre="Plan Individual",
-            descripcion="Ideal para una persona",
-            precio_mensual=8000,
-            consultas_incluidas=10,
-            personas_maximas=1,
-            incluye_medico_online=False
-        ),
-        PlanPrepaga(
-            tipo=TipoPlan.PAREJA,
-            nombre="Plan Pareja",
-            descripcion="Para dos personas",
-            precio_mensual=14000,
-            consultas_incluidas=10,
-            personas_maximas=2,
-            incluye_medico_online=False
-        ),
-        PlanPrepaga(
-            tipo=TipoPlan.FAMILIAR,
-            nombre="Plan Familiar",
-            descripcion="Hasta 4 personas",
-            precio_mensual=24000,
-            consultas_incluidas=10,
-            personas_maximas=4,
-            incluye_medico_online=True
-        ),
-        PlanPrepaga(
-            tipo=TipoPlan.FAMILIAR_MAXI,
-            nombre="Plan Familiar Maxi",
-            descripcion="Más de 4 personas",
-            precio_mensual=32000,
-            consultas_incluidas=10,
-            personas_maximas=6,
-            incluye_medico_online=True
-        ),
-    ]
-    
-    for plan in planes:
-        db.session.add(plan)
-    
-    db.session.commit()
-    print("✅ Datos de ejemplo cargados (incluyendo planes de prepaga)")
-
-@app.route('/turnos/mis-turnos')
-@login_required
-def mis_turnos():
-    usuario_id = session['user_id']
-    
-    # Turnos pendientes
-    turnos_pendientes = Turno.query.filter(
-        Turno.paciente_id == usuario_id,
-        Turno.fecha >= date.today(),
-        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-    ).order_by(Turno.fecha, Turno.hora).all()
-    
-    # Turnos realizados
-    turnos_realizados = Turno.query.filter(
-        Turno.paciente_id == usuario_id,
-        or_(
-            Turno.estado == EstadoTurno.REALIZADO,
-            and_(Turno.fecha < date.today(), Turno.estado != EstadoTurno.CANCELADO)
-        )
-    ).order_by(Turno.fecha.desc(), Turno.hora.desc()).limit(10).all()
-    
-    return render_template('turnos.html',
-                         turnos_pendientes=turnos_pendientes,
-                         turnos_realizados=turnos_realizados)
-
-@app.route('/turnos/cancelar/<int:turno_id>', methods=['POST'])
-@login_required
-def cancelar_turno(turno_id):
-    turno = Turno.query.get_or_404(turno_id)
-    
-    # Verificar que el turno pertenece al usuario
-    if turno.paciente_id != session['user_id']:
-        flash('No tiene permisos para cancelar este turno', 'danger')
-        return redirect(url_for('mis_turnos'))
-    
-    # No se puede cancelar si ya está realizado
-    if turno.estado == EstadoTurno.REALIZADO:
-        flash('No se puede cancelar un turno ya realizado', 'danger')
-        return redirect(url_for('mis_turnos'))
-    
-    turno.estado = EstadoTurno.CANCELADO
-    
-    # Si había pago asociado, cambiar estado
-    if turno.pago:
-        turno.pago.observaciones = "Turno cancelado por el paciente"
-    
-    db.session.commit()
-    flash('Turno cancelado correctamente', 'info')
-    return redirect(url_for('mis_turnos'))
-
-# ==================== PAGOS ====================
-
-@app.route('/pagos/subir-comprobante/<int:turno_id>', methods=['GET', 'POST'])
-@login_required
-def subir_comprobante(turno_id):
-    turno = Turno.query.get_or_404(turno_id)
-    
-    # Verificar que el turno pertenece al usuario
-    if turno.paciente_id != session['user_id']:
-        flash('No tiene permisos para este turno', 'danger')
-        return redirect(url_for('mis_turnos'))
-    
-    if not turno.pago:
-        flash('Este turno no tiene pago asociado', 'danger')
-        return redirect(url_for('mis_turnos'))
-    
-    if request.method == 'POST':
-        try:
-            if 'comprobante' not in request.files:
-                flash('No se seleccionó ningún archivo', 'danger')
-                return redirect(request.url)
-            
-            archivo = request.files['comprobante']
-            
-            if archivo.filename == '':
-                flash('No se seleccionó ningún archivo', 'danger')
-                return redirect(request.url)
-            
-            if not allowed_file(archivo.filename):
-                flash('Formato de archivo no permitido. Use JPG, PNG o PDF', 'danger')
-                return redirect(request.url)
-            
-            # Leer y comprimir archivo
-            archivo_bytes = archivo.read()
-            
-            if len(archivo_bytes) > app.config['MAX_CONTENT_LENGTH']:
-                flash('El archivo es demasiado grande (máximo 5MB)', 'danger')
-                return redirect(request.url)
-            
-            archivo_comprimido = comprimir_archivo(archivo_bytes)
-            
-            # Guardar en base de datos
-            pago = turno.pago
-            pago.comprobante = archivo_comprimido
-            pago.comprobante_nombre = archivo.filename
-            pago.comprobante_tipo = archivo.content_type
-            pago.fecha_subida = datetime.utcnow()
-            pago.estado = EstadoPago.PENDIENTE  # Cambiar a pendiente de aprobación
-            
-            db.session.commit()
-            
-            flash('Comprobante subido correctamente. En breve será revisado.', 'success')
-            return redirect(url_for('mis_turnos'))
-            
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al subir comprobante: {str(e)}', 'danger')
-            return redirect(request.url)
-    
-    return render_template('subir_comprobante.html', turno=turno)
-
-@app.route('/pagos/ver-comprobante/<int:pago_id>')
-@login_required
-def ver_comprobante(pago_id):
-    pago = Pago.query.get_or_404(pago_id)
-    
-    # Verificar permisos
-    usuario = Usuario.query.get(session['user_id'])
-    es_propietario = pago.turno.paciente_id == session['user_id']
-    es_admin = usuario.rol in [RolUsuario.ADMIN, RolUsuario.RECEPCION]
-    
-    if not (es_propietario or es_admin):
-        flash('No tiene permisos para ver este comprobante', 'danger')
-        return redirect(url_for('index'))
-    
-    if not pago.comprobante:
-        flash('No hay comprobante asociado a este pago', 'warning')
-        return redirect(url_for('mis_turnos'))
-    
-    try:
-        # Descomprimir archivo
-        archivo_descomprimido = descomprimir_archivo(pago.comprobante)
-        
-        # Determinar tipo MIME
-        if pago.comprobante_tipo:
-            mime_type = pago.comprobante_tipo
-        else:
-            # Inferir por extensión
-            ext = pago.comprobante_nombre.rsplit('.', 1)[1].lower()
-            mime_types = {
-                'pdf': 'application/pdf',
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png'
-            }
-            mime_type = mime_types.get(ext, 'application/octet-stream')
-        
-        return send_file(
-            io.BytesIO(archivo_descomprimido),
-            mimetype=mime_type,
-            as_attachment=False,
-            download_name=pago.comprobante_nombre
-        )
-        
-    except Exception as e:
-        flash(f'Error al recuperar comprobante: {str(e)}', 'danger')
-        return redirect(url_for('mis_turnos'))
-
-@app.route('/pagos/mis-pagos')
-@login_required
-def mis_pagos():
-    usuario_id = session['user_id']
-    
-    pagos = Pago.query.join(Turno).filter(
-        Turno.paciente_id == usuario_id
-    ).order_by(Pago.fecha_creacion.desc()).all()
-    
-    return render_template('pagos.html', pagos=pagos)
-
-# ==================== HISTORIAL ====================
-
-@app.route('/historial')
-@login_required
-def historial():
-    usuario_id = session['user_id']
-    
-    # Turnos del titular
-    turnos_titular = Turno.query.filter(
-        Turno.paciente_id == usuario_id,
-        Turno.familiar_id.is_(None),
-        Turno.estado == EstadoTurno.REALIZADO
-    ).order_by(Turno.fecha.desc()).all()
-    
-    # Turnos del grupo familiar
-    grupo_familiar = GrupoFamiliar.query.filter_by(
-        usuario_id=usuario_id,
-        activo=True
-    ).all()
-    
-    historial_familiar = {}
-    for familiar in grupo_familiar:
-        turnos = Turno.query.filter(
-            Turno.paciente_id == usuario_id,
-            Turno.familiar_id == familiar.id,
-            Turno.estado == EstadoTurno.REALIZADO
-        ).order_by(Turno.fecha.desc()).all()
-        
-        if turnos:
-            historial_familiar[familiar] = turnos
-    
-    return render_template('historial.html',
-                         turnos_titular=turnos_titular,
-                         historial_familiar=historial_familiar)
-
-@app.route('/historial/descargar-pdf/<int:persona_id>')
-@login_required
-def descargar_historial_pdf(persona_id):
-    """Genera PDF del historial (simplificado - requiere librería adicional)"""
-    # Aquí iría la lógica con reportlab o weasyprint
-    flash('Funcionalidad de PDF en desarrollo', 'info')
-    return redirect(url_for('historial'))
-
-
-# ==================== DASHBOARD ADMIN ====================
-
-@app.route('/admin/dashboard')
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def dashboard_admin():
-    # Turnos del día
-    turnos_hoy = Turno.query.filter(
-        Turno.fecha == date.today()
-    ).order_by(Turno.hora).all()
-    
-    # Pagos pendientes de aprobación
-    pagos_pendientes = Pago.query.filter(
-        Pago.estado == EstadoPago.PENDIENTE,
-        Pago.comprobante.isnot(None)
-    ).count()
-    
-    # Balance del mes
-    mes_actual = date.today().replace(day=1)
-    ingresos_mes = db.session.query(func.sum(Movimiento.monto)).filter(
-        Movimiento.tipo == TipoMovimiento.INGRESO,
-        Movimiento.fecha >= mes_actual
-    ).scalar() or 0
-    
-    egresos_mes = db.session.query(func.sum(Movimiento.monto)).filter(
-        Movimiento.tipo == TipoMovimiento.EGRESO,
-        Movimiento.fecha >= mes_actual
-    ).scalar() or 0
-    
-    balance = ingresos_mes - egresos_mes
-    
-    return render_template('dashboard_admin.html',
-                         turnos_hoy=turnos_hoy,
-                         pagos_pendientes=pagos_pendientes,
-                         ingresos_mes=ingresos_mes,
-                         egresos_mes=egresos_mes,
-                         balance=balance)
-    solicitudes_prepaga_count = SuscripcionPrepaga.query.filter_by(
-        estado=EstadoSuscripcion.PENDIENTE
-    ).count()
-    
-    pagos_mensuales_count = PagoMensualPrepaga.query.filter_by(
-        estado=EstadoPagoMensual.PENDIENTE
-    ).filter(PagoMensualPrepaga.comprobante.isnot(None)).count()
-    
-    return render_template('dashboard_admin.html',
-                         # ... variables existentes ...
-                         solicitudes_prepaga_count=solicitudes_prepaga_count,
-                         pagos_mensuales_count=pagos_mensuales_count)
-
-@app.route('/admin/buscar-paciente', methods=['GET', 'POST'])
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def buscar_paciente():
-    if request.method == 'POST':
-        dni = request.form.get('dni')
-        
-        usuario = Usuario.query.filter_by(dni=dni).first()
-        
-        if not usuario:
-            flash('No se encontró paciente con ese DNI', 'warning')
-            return render_template('buscar_paciente.html', usuario=None)
-        
-        # Turnos del paciente
-        turnos = Turno.query.filter_by(paciente_id=usuario.id).order_by(
-            Turno.fecha.desc(), Turno.hora.desc()
-        ).limit(10).all()
-        
-        return render_template('buscar_paciente.html',
-                             usuario=usuario,
-                             turnos=turnos)
-    
-    return render_template('buscar_paciente.html', usuario=None)
-
-@app.route('/admin/marcar-abonado/<int:pago_id>', methods=['POST'])
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def marcar_abonado(pago_id):
-    pago = Pago.query.get_or_404(pago_id)
-    
-    if pago.estado == EstadoPago.ABONADO_EFECTIVO:
-        flash('Este pago ya fue marcado como abonado', 'info')
-        return redirect(request.referrer or url_for('dashboard_admin'))
-    
-    pago.estado = EstadoPago.ABONADO_EFECTIVO
-    pago.fecha_aprobacion = datetime.utcnow()
-    pago.aprobado_por = session['user_id']
-    
-    # Confirmar turno
-    pago.turno.estado = EstadoTurno.CONFIRMADO
-    
-    # Registrar ingreso
-    movimiento = Movimiento(
-        tipo=TipoMovimiento.INGRESO,
-        monto=pago.monto,
-        concepto=f"Pago en efectivo - Turno {pago.turno_id}",
-        pago_id=pago.id,
-        usuario_registro=session['user_id']
-    )
-    
-    db.session.add(movimiento)
-    db.session.commit()
-    
-    flash('Pago registrado como abonado en efectivo', 'success')
-    return redirect(request.referrer or url_for('dashboard_admin'))
-
-@app.route('/admin/aprobar-pago/<int:pago_id>', methods=['POST'])
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def aprobar_pago(pago_id):
-    pago = Pago.query.get_or_404(pago_id)
-    
-    pago.estado = EstadoPago.APROBADO
-    pago.fecha_aprobacion = datetime.utcnow()
-    pago.aprobado_por = session['user_id']
-    
-    # Confirmar turno
-    pago.turno.estado = EstadoTurno.CONFIRMADO
-    
-    # Registrar ingreso
-    movimiento = Movimiento(
-        tipo=TipoMovimiento.INGRESO,
-        monto=pago.monto,
-        concepto=f"Pago transferencia - Turno {pago.turno_id}",
-        pago_id=pago.id,
-        usuario_registro=session['user_id']
-    )
-    
-    db.session.add(movimiento)
-    db.session.commit()
-    
-    flash('Pago aprobado correctamente', 'success')
-    return redirect(url_for('revisar_pagos'))
-
-@app.route('/admin/rechazar-pago/<int:pago_id>', methods=['POST'])
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def rechazar_pago(pago_id):
-    pago = Pago.query.get_or_404(pago_id)
-    
-    observaciones = request.form.get('observaciones', 'Comprobante inválido')
-    
-    pago.estado = EstadoPago.RECHAZADO
-    pago.observaciones = observaciones
-    pago.aprobado_por = session['user_id']
-    
-    db.session.commit()
-    
-    flash('Pago rechazado', 'info')
-    return redirect(url_for('revisar_pagos'))
-
-@app.route('/admin/pagos')
-@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
-def revisar_pagos():
-    # Pagos pendientes
-    pagos_pendientes = Pago.query.filter(
-        Pago.estado == EstadoPago.PENDIENTE,
-        Pago.comprobante.isnot(None)
-    ).order_by(Pago.fecha_subida.desc()).all()
-    
-    # Pagos recientes
-    pagos_recientes = Pago.query.filter(
-        Pago.estado.in_([EstadoPago.APROBADO, EstadoPago.RECHAZADO, EstadoPago.ABONADO_EFECTIVO])
-    ).order_by(Pago.fecha_aprobacion.desc()).limit(20).all()
-    
-    return render_template('admin_pagos.html',
-                         pagos_pendientes=pagos_pendientes,
-                         pagos_recientes=pagos_recientes)
-
-# ==================== MOVIMIENTOS ====================
-
-@app.route('/admin/movimientos')
-@role_required(RolUsuario.ADMIN)
-def ver_movimientos():
-    # Filtros
-    fecha_desde = request.args.get('fecha_desde')
-    fecha_hasta = request.args.get('fecha_hasta')
-    tipo = request.args.get('tipo')
-    
-    query = Movimiento.query
-    
-    if fecha_desde:
-        query = query.filter(Movimiento.fecha >= datetime.strptime(fecha_desde, '%Y-%m-%d'))
-    if fecha_hasta:
-        query = query.filter(Movimiento.fecha <= datetime.strptime(fecha_hasta, '%Y-%m-%d'))
-    if tipo:
-        query = query.filter(Movimiento.tipo == TipoMovimiento[tipo.upper()])
-    
-    movimientos = query.order_by(Movimiento.fecha.desc()).all()
-    
-    # Calcular totales
-    total_ingresos = sum(m.monto for m in movimientos if m.tipo == TipoMovimiento.INGRESO)
-    total_egresos = sum(m.monto for m in movimientos if m.tipo == TipoMovimiento.EGRESO)
-    balance = total_ingresos - total_egresos
-    
-    return render_template('movimientos.html',
-                         movimientos=movimientos,
-                         total_ingresos=total_ingresos,
-                         total_egresos=total_egresos,
-                         balance=balance)
-
-@app.route('/admin/movimientos/nuevo', methods=['GET', 'POST'])
-@role_required(RolUsuario.ADMIN)
-def nuevo_movimiento():
-    if request.method == 'POST':
-        try:
-            tipo = TipoMovimiento[request.form.get('tipo').upper()]
-            monto = float(request.form.get('monto'))
-            concepto = request.form.get('concepto')
-            descripcion = request.form.get('descripcion')
-            
-            movimiento = Movimiento(
-                tipo=tipo,
-                monto=monto,
-                concepto=concepto,
-                descripcion=descripcion,
-                usuario_registro=session['user_id']
-            )
-            
-            db.session.add(movimiento)
-            db.session.commit()
-            
-            flash('Movimiento registrado correctamente', 'success')
-            return redirect(url_for('ver_movimientos'))
-            
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al registrar movimiento: {str(e)}', 'danger')
-    
-    return render_template('movimiento_nuevo.html')
-
-# ==================== DASHBOARD ESPECIALISTA ====================
-
-@app.route('/especialista/dashboard')
-@role_required(RolUsuario.ESPECIALISTA)
-def dashboard_especialista():
-    especialista_id = session['user_id']
-    
-    # Turnos de hoy
-    turnos_hoy = Turno.query.filter(
-        Turno.especialista_id == especialista_id,
-        Turno.fecha == date.today()
-    ).order_by(Turno.hora).all()
-    
-    # Próximos turnos
-    turnos_proximos = Turno.query.filter(
-        Turno.especialista_id == especialista_id,
-        Turno.fecha > date.today(),
-        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-    ).order_by(Turno.fecha, Turno.hora).limit(10).all()
-    
-    return render_template('dashboard_especialista.html',
-                         turnos_hoy=turnos_hoy,
-                         turnos_proximos=turnos_proximos)
-
-
-@app.route('/api/especialistas-por-especialidad')
-@login_required
-def especialistas_por_especialidad():
-    especialidad_id = request.args.get('especialidad_id')
-    if not especialidad_id:
-        return {'error': 'Faltan parámetros'}, 400
-    
-    # Buscamos especialistas vinculados a esa especialidad
-    # Unimos con la tabla Usuario para obtener los nombres
-    especialistas = db.session.query(Usuario).join(
-        EspecialistaEspecialidad, 
-        EspecialistaEspecialidad.especialista_id == Usuario.id
-    ).filter(
-        EspecialistaEspecialidad.especialidad_id == especialidad_id,
-        EspecialistaEspecialidad.activo == True
-    ).all()
-    
-    return {
-        'especialistas': [
-            {
-                'id': esp.id, 
-                'nombre': f"{esp.nombre} {esp.apellido}"
-            } for esp in especialistas
-        ]
-    }
-
-@app.route('/api/turnos/horarios-disponibles')
-@login_required
-def horarios_disponibles():
-    especialista_id = request.args.get('especialista_id')
-    especialidad_id = request.args.get('especialidad_id')
-    fecha_str = request.args.get('fecha')
-    
-    if not all([especialista_id, especialidad_id, fecha_str]):
-        return {'error': 'Faltan parámetros'}, 400
-    
-    fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-    
-    # USAMOS TU GENERADOR DE TURNOS (Lógica del archivo turno_generator.py)
-    slots = GeneradorTurnos.obtener_slots_disponibles(
-        int(especialista_id), 
-        int(especialidad_id), 
-        fecha
-    )
-    
-    # Filtramos solo los que están disponibles para la API
-    horarios_finales = [s['hora_inicio'].strftime('%H:%M') for s in slots if s['disponible']]
-    
-    return {'horarios': horarios_finales}
-
-@app.route('/especialista/atender-turno/<int:turno_id>', methods=['GET', 'POST'])
-@role_required(RolUsuario.ESPECIALISTA)
-def atender_turno(turno_id):
-    turno = Turno.query.get_or_404(turno_id)
-    
-    # Verificar que el turno es del especialista
-    if turno.especialista_id != session['user_id']:
-        flash('No tiene permisos para este turno', 'danger')
-        return redirect(url_for('dashboard_especialista'))
-    
-    if request.method == 'POST':
-        observaciones = request.form.get('observaciones')
-        
-        turno.observaciones = observaciones
-        turno.estado = EstadoTurno.REALIZADO
-        
-        db.session.commit()
-        
-        flash('Turno marcado como realizado', 'success')
-        return redirect(url_for('dashboard_especialista'))
-    
-    return render_template('atender_turno.html', turno=turno)
-
-# ==================== INICIALIZACIÓN ====================
-
-@app.cli.command()
-def init_db():
-    """Crea todas las tablas en la base de datos"""
-    db.create_all()
-    print("✅ Base de datos inicializada")
-
-# @app.cli.command()
-# def seed_db():
-#     """Carga datos de ejemplo"""
-    
-#     # Admin
-#     admin = Usuario(
-#         nombre="Admin",
-#         apellido="Sistema",
-#         dni="00000000",
-#         email="admin@consultorio.com",
-#         telefono="1234567890",
-#         rol=RolUsuario.ADMIN
-#     )
-#     admin.set_password("admin123")
-#     db.session.add(admin)
-    
-#     # Especialidades
-#     especialidades = [
-#         Especialidad(nombre="Clínica Médica", costo_consulta=15000, duracion_turno=30),
-#         Especialidad(nombre="Pediatría", costo_consulta=15000, duracion_turno=30),
-#         Especialidad(nombre="Cardiología", costo_consulta=20000, duracion_turno=45),
-#         Especialidad(nombre="Dermatología", costo_consulta=18000, duracion_turno=30),
-#     ]
-    
-#     for esp in especialidades:
-#         db.session.add(esp)
-    
-#     db.session.commit()
-#     print("✅ Datos de ejemplo cargados")
-
-if __name__ == '__main__':
+from flask import Flask, abort, render_template, request, redirect, url_for, session, flash, send_file, g
+from flask.json.provider import JSONProvider
+import orjson
+from functools import wraps
+from werkzeug.security import check_password_hash
+from flask_compress import Compress
+from calendar import monthrange
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import case, event, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, raiseload, selectinload
+import hashlib
+import io
+import threading
+from collections import deque
+from time import monotonic
+from types import MappingProxyType
+import os
+
+
+import almacenamiento
+from compresion import abrir_archivo, comprimir_archivo, contenido_codificado
+from config import Config
+from models import (db, Usuario, GrupoFamiliar, Especialidad, Turno, Pago, 
+                   Movimiento, HorarioDisponible, RolUsuario, EstadoTurno, 
+                   EstadoPago, TipoMovimiento)
+from admin_routes import admin_bp, obtener_especialidades_activas
+from cache_utils import cache
+from models_admin import EspecialistaEspecialidad
+from turno_generator import GeneradorTurnos
+from prepaga_routes import prepaga_bp
+from models_prepaga import (SuscripcionPrepaga, EstadoSuscripcion, PlanPrepaga, TipoPlan,
+                            HistorialConsultasPrepaga, PagoMensualPrepaga, EstadoPagoMensual)
+
+class OrjsonProvider(JSONProvider):
+    """Serialización JSON con orjson para todas las vistas.
+
+    Las APIs del admin ya serializan con orjson a mano; con el provider
+    los endpoints que devuelven dicts (especialistas, horarios) lo usan
+    también sin tocar cada vista.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # default=str cubre Decimal (montos) que orjson no serializa solo
+        return orjson.dumps(obj, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app = Flask(__name__)
+app.config.from_object(Config)
+app.json = OrjsonProvider(app)
+
+# Constantes de costo leídas una sola vez al importar; evita el lookup en
+# app.config en cada request de los endpoints de simulación
+COSTO_BASE = app.config['COSTO_BASE_CONSULTA']
+DESCUENTO = app.config['DESCUENTO_GRUPO_FAMILIAR']
+
+db.init_app(app)
+
+# Compresión de respuestas HTML/JSON al vuelo; el nivel viene de config
+# (bajo: en gunicorn el gzip por respuesta compite por CPU con los workers)
+Compress(app)
+
+# Sesiones server-side en Redis si el deployment las configura
+# (SESSION_REDIS_URL). Evita firmar/serializar la cookie completa en cada
+# respuesta; sin esa variable se mantienen las cookies firmadas de Flask.
+if os.environ.get('SESSION_REDIS_URL'):
+    import redis
+    from flask_session import Session
+
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.from_url(os.environ['SESSION_REDIS_URL'])
+    app.config['SESSION_PERMANENT'] = True
+    Session(app)
+
+# MAX_CONTENT_LENGTH hace que Werkzeug corte el upload excedido antes
+# de bufferearlo entero; este handler convierte ese 413 en el mismo
+# flash que daban los chequeos post-read de los formularios
+@app.errorhandler(413)
+def archivo_demasiado_grande(e):
+    flash('El archivo es demasiado grande (máximo 5MB)', 'danger')
+    return redirect(request.url)
+
+
+# Registrar Blueprint de administración
+app.register_blueprint(admin_bp)
+app.register_blueprint(prepaga_bp)
+
+# ==================== DECORADORES ====================
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Debe iniciar sesión para acceder a esta página', 'warning')
+            return redirect(url_for('login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def role_required(*roles):
+    # El set de roles permitidos se arma una sola vez al decorar;
+    # en el request sólo se compara el string guardado en la sesión
+    roles_permitidos = frozenset(rol.value for rol in roles)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                flash('Debe iniciar sesión', 'warning')
+                return redirect(url_for('login'))
+
+            # El rol ya viene en la sesión desde el login: alcanza con
+            # compararlo, sin re-consultar el usuario en cada request
+            rol_sesion = session.get('user_rol')
+            if rol_sesion is None:
+                usuario = db.session.get(Usuario, session['user_id'])
+                rol_sesion = usuario.rol.value if usuario else None
+
+            if rol_sesion not in roles_permitidos:
+                flash('No tiene permisos para acceder a esta página', 'danger')
+                return redirect(url_for('index'))
+
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# ==================== UTILIDADES ====================
+
+# Congeladas a nivel módulo: se consultan en cada upload/descarga y no
+# hay motivo para rearmarlas (o buscar en app.config) por request
+_EXTENSIONES_PERMITIDAS = frozenset(Config.ALLOWED_EXTENSIONS)
+_MIME_POR_EXTENSION = MappingProxyType({
+    'pdf': 'application/pdf',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png'
+})
+
+def allowed_file(filename):
+    """Verifica si el archivo tiene una extensión permitida"""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in _EXTENSIONES_PERMITIDAS
+
+def _bind_lectura():
+    """bind_arguments para rutear una lectura a la réplica, si existe.
+
+    Con DATABASE_URL_RO configurada devuelve el engine del bind
+    'readonly'; si no, un dict vacío y el statement va al primario como
+    siempre. Solo para lecturas puras que toleran el lag de réplica
+    (agregados de reportes); las escrituras siguen en el default.
+    """
+    try:
+        return {'bind': db.engines['readonly']}
+    except KeyError:
+        return {}
+
+def _carga_estricta():
+    """Opciones extra de query: raiseload('*') si STRICT_LOADING está activo.
+
+    Convierte cualquier lazy-load no declarado en un error ruidoso durante
+    dev/CI; en producción devuelve una tupla vacía y no cambia nada.
+    """
+    if app.config['STRICT_LOADING']:
+        return (raiseload('*'),)
+    return ()
+
+def _costo(cant_familiares):
+    """Costo final para una cantidad de familiares (tope 50% de descuento)"""
+    return COSTO_BASE * (1 - min(DESCUENTO * cant_familiares, 0.5))
+
+def calcular_costo_grupo_familiar(usuario_id, cant_familiares=None):
+    """Calcula el costo con descuento por grupo familiar.
+
+    Si el llamador ya conoce la cantidad de familiares la pasa y se evita
+    el COUNT; si no, el resultado se memoiza en g por si se vuelve a pedir
+    dentro del mismo request.
+    """
+    if cant_familiares is None:
+        cache_request = getattr(g, '_cant_familiares', None)
+        if cache_request is None:
+            cache_request = g._cant_familiares = {}
+        cant_familiares = cache_request.get(usuario_id)
+        if cant_familiares is None:
+            cant_familiares = db.session.query(func.count(GrupoFamiliar.id)).filter_by(
+                usuario_id=usuario_id,
+                activo=True
+            ).scalar()
+            cache_request[usuario_id] = cant_familiares
+    
+    return _costo(cant_familiares)
+
+# ==================== RUTAS PÚBLICAS ====================
+
+@app.route('/')
+def index():
+    especialidades = obtener_especialidades_activas()
+    
+    return render_template('index.html', 
+                         especialidades=especialidades,
+                         costo_base=COSTO_BASE)
+
+@app.route('/simular-costo', methods=['POST'])
+def simular_costo():
+    """Simula el costo según cantidad de familiares"""
+    cant_familiares = int(request.form.get('cant_familiares', 0))
+    
+    descuento_total = min(DESCUENTO * cant_familiares, 0.5)
+    costo_final = _costo(cant_familiares)
+    ahorro = COSTO_BASE - costo_final
+    
+    return render_template('simulador_result.html',
+                         costo_base=COSTO_BASE,
+                         cant_familiares=cant_familiares,
+                         descuento_pct=descuento_total * 100,
+                         costo_final=costo_final,
+                         ahorro=ahorro)
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        try:
+            # Datos del usuario
+            nombre = request.form.get('nombre')
+            apellido = request.form.get('apellido')
+            dni = request.form.get('dni')
+            email = request.form.get('email')
+            telefono = request.form.get('telefono')
+            password = request.form.get('password')
+            password_confirm = request.form.get('password_confirm')
+            
+            # Validaciones
+            if password != password_confirm:
+                flash('Las contraseñas no coinciden', 'danger')
+                return redirect(url_for('register'))
+            
+            # Un solo round-trip para ambos chequeos de duplicados,
+            # trayendo sólo las dos columnas (sin hidratar el Usuario)
+            existente = db.session.query(Usuario.dni, Usuario.email).filter(
+                or_(Usuario.dni == dni, Usuario.email == email)
+            ).first()
+            
+            if existente:
+                if existente.dni == dni:
+                    flash('El DNI ya está registrado', 'danger')
+                else:
+                    flash('El email ya está registrado', 'danger')
+                return redirect(url_for('register'))
+            
+            # Crear usuario
+            usuario = Usuario(
+                nombre=nombre,
+                apellido=apellido,
+                dni=dni,
+                email=email,
+                telefono=telefono,
+                rol=RolUsuario.PACIENTE
+            )
+            usuario.set_password(password)
+            
+            db.session.add(usuario)
+            db.session.flush()  # Para obtener el ID
+            
+            # Grupo familiar (opcional)
+            familiares_nombres = request.form.getlist('familiar_nombre[]')
+            familiares_apellidos = request.form.getlist('familiar_apellido[]')
+            familiares_dnis = request.form.getlist('familiar_dni[]')
+            familiares_parentescos = request.form.getlist('familiar_parentesco[]')
+            
+            familiares = [
+                GrupoFamiliar(
+                    usuario_id=usuario.id,
+                    nombre=nombre_f,
+                    apellido=apellido_f,
+                    dni=dni_f,
+                    parentesco=parentesco_f
+                )
+                for nombre_f, apellido_f, dni_f, parentesco_f in zip(
+                    familiares_nombres, familiares_apellidos,
+                    familiares_dnis, familiares_parentescos
+                )
+                if nombre_f and dni_f
+            ]
+            # Un solo INSERT multi-fila en lugar de uno por familiar
+            if familiares:
+                db.session.bulk_save_objects(familiares)
+            
+            db.session.commit()
+            
+            flash('Registro exitoso. Ya puede iniciar sesión', 'success')
+            return redirect(url_for('login'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al registrar: {str(e)}', 'danger')
+            return redirect(url_for('register'))
+    
+    return render_template('register.html')
+
+# Límite de intentos de login por IP: verificar un hash cuesta cientos de
+# milisegundos de CPU, así que una ráfaga de POSTs tumba los workers.
+_LOGIN_MAX_INTENTOS = 10
+_LOGIN_VENTANA_SEG = 60.0
+# Tope de IPs rastreadas: al alcanzarlo se barren las entradas con la
+# ventana ya vencida, así el dict no crece sin límite con IPs distintas
+# durante la vida del worker
+_LOGIN_MAX_IPS = 10000
+_login_intentos = {}
+_login_lock = threading.Lock()
+
+
+def _login_permitido(ip):
+    """True si la IP no superó el límite de intentos en la ventana"""
+    ahora = monotonic()
+    with _login_lock:
+        if len(_login_intentos) >= _LOGIN_MAX_IPS:
+            vencidas = [
+                otra for otra, cola in _login_intentos.items()
+                if not cola or ahora - cola[-1] > _LOGIN_VENTANA_SEG
+            ]
+            for otra in vencidas:
+                del _login_intentos[otra]
+        intentos = _login_intentos.setdefault(ip, deque())
+        while intentos and ahora - intentos[0] > _LOGIN_VENTANA_SEG:
+            intentos.popleft()
+        if len(intentos) >= _LOGIN_MAX_INTENTOS:
+            return False
+        intentos.append(ahora)
+        return True
+
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        if not _login_permitido(request.remote_addr or ''):
+            flash('Demasiados intentos. Espere un minuto y vuelva a intentar', 'warning')
+            return render_template('login.html'), 429
+        
+        dni = request.form.get('dni')
+        password = request.form.get('password')
+        
+        # Sólo las columnas que usa el login: evita hidratar el Usuario
+        # completo (y cualquier columna pesada futura) en cada intento
+        usuario = db.session.query(
+            Usuario.id, Usuario.nombre, Usuario.apellido,
+            Usuario.rol, Usuario.password_hash
+        ).filter_by(dni=dni, activo=True).first()
+        
+        if usuario and check_password_hash(usuario.password_hash, password):
+            # El rol se maneja como string de acá en adelante: es lo que
+            # guarda la sesión y lo que comparan los decoradores
+            rol_valor = usuario.rol.value
+            
+            session.permanent = True
+            session['user_id'] = usuario.id
+            session['user_rol'] = rol_valor
+            session['user_nombre'] = f"{usuario.nombre} {usuario.apellido}"
+            
+            flash(f'Bienvenido/a {usuario.nombre}', 'success')
+            
+            # Redireccionar según rol
+            if rol_valor in ('admin', 'recepcion'):
+                return redirect(url_for('dashboard_admin'))
+            elif rol_valor == 'especialista':
+                return redirect(url_for('dashboard_especialista'))
+            else:
+                return redirect(url_for('dashboard_user'))
+        else:
+            flash('DNI o contraseña incorrectos', 'danger')
+    
+    return render_template('login.html')
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    flash('Sesión cerrada correctamente', 'info')
+    return redirect(url_for('index'))
+
+# ==================== RUTAS USUARIO ====================
+
+# @app.route('/dashboard')
+# @login_required
+# def dashboard_user():
+#     usuario = Usuario.query.get(session['user_id'])
+    
+#     # Turnos próximos
+#     turnos_proximos = Turno.query.filter(
+#         Turno.paciente_id == usuario.id,
+#         Turno.fecha >= date.today(),
+#         Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+#     ).order_by(Turno.fecha, Turno.hora).limit(5).all()
+    
+#     # Pagos pendientes
+#     pagos_pendientes = Pago.query.join(Turno).filter(
+#         Turno.paciente_id == usuario.id,
+#         Pago.estado == EstadoPago.PENDIENTE
+#     ).all()
+    
+#     # Grupo familiar
+#     grupo_familiar = GrupoFamiliar.query.filter_by(
+#         usuario_id=usuario.id,
+#         activo=True
+#     ).all()
+    
+#     return render_template('dashboard_user.html',
+#                          usuario=usuario,
+#                          turnos_proximos=turnos_proximos,
+#                          pagos_pendientes=pagos_pendientes,
+#                          grupo_familiar=grupo_familiar)
+
+# ==================== TURNOS ====================
+# @app.route('/turnos/nuevo', methods=['GET', 'POST'])
+# @login_required
+# def nuevo_turno():
+#     if request.method == 'POST':
+#         # 1. Capturamos los datos del formulario (incluyendo el nuevo especialista_id)
+#         especialidad_id = request.form.get('especialidad_id')
+#         especialista_id = request.form.get('especialista_id')  # <--- AGREGAR ESTA LÍNEA
+#         familiar_id = request.form.get('familiar_id')
+#         fecha_str = request.form.get('fecha')
+#         hora = request.form.get('hora')
+#         motivo_consulta = request.form.get('motivo_consulta')
+
+#         try:
+#             # 2. Creamos la instancia del Turno
+#             nuevo_turno = Turno(
+#                 paciente_id=session['user_id'],
+#                 especialista_id=int(especialista_id), # <--- ASIGNAR EL ID AQUÍ
+#                 especialidad_id=int(especialidad_id),
+#                 familiar_id=int(familiar_id) if familiar_id else None,
+#                 fecha=datetime.strptime(fecha_str, '%Y-%m-%d').date(),
+#                 hora=hora,
+#                 motivo_consulta=motivo_consulta,
+#                 estado=EstadoTurno.PENDIENTE # O el estado inicial que uses
+#             )
+
+#             db.session.add(nuevo_turno)
+#             db.session.commit()
+            
+#             flash('¡Turno agendado con éxito!', 'success')
+#             return redirect(url_for('mis_turnos'))
+
+#         except Exception as e:
+#             db.session.rollback()
+#             flash(f'Error al agendar el turno: {str(e)}', 'danger')
+#             return redirect(url_for('nuevo_turno'))
+
+#     # Si es GET, cargamos las especialidades y familiares normalmente
+#     especialidades = Especialidad.query.all()
+#     grupo_familiar = GrupoFamiliar.query.filter_by(usuario_id=session['user_id']).all()
+#     return render_template('turnos_nuevo.html', 
+#                            especialidades=especialidades, 
+#                            grupo_familiar=grupo_familiar,
+#                            today=date.today().isoformat())
+
+# @app.route('/turnos/nuevo', methods=['GET', 'POST'])ESTE ES EL ULTIMO QUE FUNCIONA
+# @login_required
+# def nuevo_turno():
+#     if request.method == 'POST':
+#         try:
+#             # 1. Capturar todos los datos del formulario
+#             paciente_id = session['user_id']
+#             especialidad_id = request.form.get('especialidad_id')
+#             especialista_id = request.form.get('especialista_id')  # ID del especialista seleccionado
+#             familiar_id = request.form.get('familiar_id')  # Opcional
+#             fecha_str = request.form.get('fecha')
+#             hora_str = request.form.get('hora')
+#             motivo_consulta = request.form.get('motivo_consulta')
+            
+#             # 2. Validaciones básicas
+#             if not all([especialidad_id, especialista_id, fecha_str, hora_str]):
+#                 flash('Por favor complete todos los campos obligatorios', 'danger')
+#                 return redirect(url_for('nuevo_turno'))
+            
+#             # 3. Convertir fecha y hora
+#             fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+#             hora_turno = datetime.strptime(hora_str, '%H:%M').time()
+            
+#             # 4. Validar que no exista turno en ese horario para ese especialista
+#             turno_existente = Turno.query.filter_by(
+#                 especialista_id=int(especialista_id),
+#                 fecha=fecha_turno,
+#                 hora=hora_turno,
+#                 estado=EstadoTurno.PENDIENTE
+#             ).first()
+            
+#             if turno_existente:
+#                 flash('Ese horario ya está ocupado para este especialista', 'danger')
+#                 return redirect(url_for('nuevo_turno'))
+            
+#             # 5. Crear el turno
+#             nuevo_turno = Turno(
+#                 paciente_id=paciente_id,
+#                 especialista_id=int(especialista_id),
+#                 especialidad_id=int(especialidad_id),
+#                 familiar_id=int(familiar_id) if familiar_id else None,
+#                 fecha=fecha_turno,
+#                 hora=hora_turno,
+#                 motivo_consulta=motivo_consulta,
+#                 estado=EstadoTurno.PENDIENTE
+#             )
+            
+#             db.session.add(nuevo_turno)
+#             db.session.flush()  # Obtener el ID del turno sin hacer commit
+            
+#             # 6. Calcular costo con descuento por grupo familiar
+#             costo = calcular_costo_grupo_familiar(paciente_id)
+            
+#             # 7. Crear pago asociado automáticamente
+#             nuevo_pago = Pago(
+#                 turno_id=nuevo_turno.id,
+#                 monto=costo,
+#                 estado=EstadoPago.PENDIENTE
+#             )
+            
+#             db.session.add(nuevo_pago)
+#             db.session.commit()
+            
+#             flash('¡Turno agendado con éxito! Debe subir el comprobante de pago para confirmar.', 'success')
+#             return redirect(url_for('mis_turnos'))
+            
+#         except ValueError as ve:
+#             db.session.rollback()
+#             flash(f'Error en el formato de fecha u hora: {str(ve)}', 'danger')
+#             return redirect(url_for('nuevo_turno'))
+#         except Exception as e:
+#             db.session.rollback()
+#             flash(f'Error al crear turno: {str(e)}', 'danger')
+#             return redirect(url_for('nuevo_turno'))
+    
+#     # GET - Cargar datos para el formulario
+#     especialidades = Especialidad.query.filter_by(activo=True).all()
+#     grupo_familiar = GrupoFamiliar.query.filter_by(
+#         usuario_id=session['user_id'],
+#         activo=True
+#     ).all()
+    
+#     return render_template('turnos_nuevo.html',
+#                          especialidades=especialidades,
+#                          grupo_familiar=grupo_familiar,
+#                          today=date.today().isoformat())
+
+# @app.route('/turnos/nuevo', methods=['GET', 'POST'])
+# @login_required
+# def nuevo_turno():
+#     if request.method == 'POST':
+#         try:
+#             paciente_id = session['user_id']
+#             especialidad_id = request.form.get('especialidad_id')
+#             fecha_str = request.form.get('fecha')
+#             hora_str = request.form.get('hora')
+#             familiar_id = request.form.get('familiar_id')  # Opcional
+#             motivo = request.form.get('motivo_consulta')
+            
+#             # Convertir fecha y hora
+#             fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+#             hora_turno = datetime.strptime(hora_str, '%H:%M').time()
+            
+#             # Validar que no exista turno en ese horario
+#             turno_existente = Turno.query.filter_by(
+#                 especialidad_id=especialidad_id,
+#                 fecha=fecha_turno,
+#                 hora=hora_turno,
+#                 estado=EstadoTurno.PENDIENTE
+#             ).first()
+            
+#             if turno_existente:
+#                 flash('Ese horario ya está ocupado', 'danger')
+#                 return redirect(url_for('nuevo_turno'))
+            
+#             # Crear turno
+#             turno = Turno(
+#                 paciente_id=paciente_id,
+#                 especialidad_id=especialidad_id,
+#                 fecha=fecha_turno,
+#                 hora=hora_turno,
+#                 familiar_id=familiar_id if familiar_id else None,
+#                 motivo_consulta=motivo,
+#                 estado=EstadoTurno.PENDIENTE
+#             )
+            
+#             db.session.add(turno)
+#             db.session.flush()
+            
+#             # Crear pago asociado
+#             especialidad = Especialidad.query.get(especialidad_id)
+#             usuario = Usuario.query.get(paciente_id)
+            
+#             # Calcular costo con descuento por grupo familiar
+#             costo = calcular_costo_grupo_familiar(paciente_id)
+            
+#             pago = Pago(
+#                 turno_id=turno.id,
+#                 monto=costo,
+#                 estado=EstadoPago.PENDIENTE
+#             )
+            
+#             db.session.add(pago)
+#             db.session.commit()
+            
+#             flash('Turno solicitado correctamente. Debe abonar para confirmar.', 'success')
+#             return redirect(url_for('mis_turnos'))
+            
+#         except Exception as e:
+#             db.session.rollback()
+#             flash(f'Error al crear turno: {str(e)}', 'danger')
+#             return redirect(url_for('nuevo_turno'))
+    
+#     # GET
+#     especialidades = Especialidad.query.filter_by(activo=True).all()
+#     grupo_familiar = GrupoFamiliar.query.filter_by(
+#         usuario_id=session['user_id'],
+#         activo=True
+#     ).all()
+    
+#     return render_template('turnos_nuevo.html',
+#                          especialidades=especialidades,
+#                          grupo_familiar=grupo_familiar)
+
+# @app.route('/api/turnos/horarios-disponibles')
+# @login_required
+# def horarios_disponibles():
+#     """API para obtener horarios disponibles según especialidad y fecha"""
+#     especialidad_id = request.args.get('especialidad_id')
+#     fecha_str = request.args.get('fecha')
+    
+#     if not especialidad_id or not fecha_str:
+#         return {'error': 'Faltan parámetros'}, 400
+    
+#     fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+#     dia_semana = fecha.weekday()
+    
+#     # Obtener horarios configurados para ese día
+#     especialidad = Especialidad.query.get(especialidad_id)
+#     duracion = especialidad.duracion_turno
+    
+#     # Horarios genéricos (8:00 a 18:00, cada 30 min por defecto)
+#     horarios = []
+#     hora_inicio = time(8, 0)
+#     hora_fin = time(18, 0)
+    
+#     hora_actual = datetime.combine(date.today(), hora_inicio)
+#     hora_final = datetime.combine(date.today(), hora_fin)
+    
+#     while hora_actual < hora_final:
+#         horarios.append(hora_actual.time().strftime('%H:%M'))
+#         hora_actual += timedelta(minutes=duracion)
+    
+#     # Filtrar horarios ocupados
+#     turnos_ocupados = Turno.query.filter(
+#         Turno.especialidad_id == especialidad_id,
+#         Turno.fecha == fecha,
+#         Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+#     ).all()
+    
+#     horarios_ocupados = [t.hora.strftime('%H:%M') for t in turnos_ocupados]
+#     horarios_disponibles = [h for h in horarios if h not in horarios_ocupados]
+    
+#     return {'horarios': horarios_disponibles}
+
+@app.route('/turnos/nuevo', methods=['GET', 'POST'])
+@login_required
+def nuevo_turno():
+    if request.method == 'POST':
+        try:
+            # 1. Capturar todos los datos del formulario
+            paciente_id = session['user_id']
+            especialidad_id = request.form.get('especialidad_id')
+            especialista_id = request.form.get('especialista_id')
+            familiar_id = request.form.get('familiar_id')
+            fecha_str = request.form.get('fecha')
+            hora_str = request.form.get('hora')
+            motivo_consulta = request.form.get('motivo_consulta')
+            
+            # 2. Validaciones básicas
+            if not all([especialidad_id, especialista_id, fecha_str, hora_str]):
+                flash('Por favor complete todos los campos obligatorios', 'danger')
+                return redirect(url_for('nuevo_turno'))
+            
+            # 3. Convertir fecha y hora
+            fecha_turno = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+            hora_turno = datetime.strptime(hora_str, '%H:%M').time()
+            
+            # 4. Chequeo rápido de disponibilidad con EXISTS (no hidrata
+            # ningún Turno y contempla también los confirmados); la garantía
+            # final contra carreras sigue siendo el índice único uq_turno_slot
+            ocupado = db.session.query(
+                Turno.query.filter(
+                    Turno.especialista_id == int(especialista_id),
+                    Turno.fecha == fecha_turno,
+                    Turno.hora == hora_turno,
+                    Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+                ).exists()
+            ).scalar()
+            
+            if ocupado:
+                flash('Ese horario ya está ocupado para este especialista', 'danger')
+                return redirect(url_for('nuevo_turno'))
+            
+            # 5. Verificar si el usuario tiene suscripción de prepaga activa
+            suscripcion = SuscripcionPrepaga.query.filter_by(
+                usuario_id=paciente_id,
+                estado=EstadoSuscripcion.ACTIVA
+            ).first()
+            
+            # 6. Crear el turno
+            nuevo_turno = Turno(
+                paciente_id=paciente_id,
+                especialista_id=int(especialista_id),
+                especialidad_id=int(especialidad_id),
+                familiar_id=int(familiar_id) if familiar_id else None,
+                fecha=fecha_turno,
+                hora=hora_turno,
+                motivo_consulta=motivo_consulta,
+                estado=EstadoTurno.PENDIENTE
+            )
+            
+            db.session.add(nuevo_turno)
+            db.session.flush()  # Obtener el ID del turno
+            
+            # 7. Procesar según tenga o no prepaga
+            if suscripcion and suscripcion.tiene_consultas_disponibles():
+                # ✅ TIENE PREPAGA CON CONSULTAS DISPONIBLES
+                
+                # Consumir consulta
+                consultas_antes = suscripcion.consultas_restantes
+                suscripcion.consumir_consulta()
+                consultas_despues = suscripcion.consultas_restantes
+                
+                # Registrar en historial
+                historial = HistorialConsultasPrepaga(
+                    suscripcion_id=suscripcion.id,
+                    turno_id=nuevo_turno.id,
+                    consultas_antes=consultas_antes,
+                    consultas_despues=consultas_despues
+                )
+                db.session.add(historial)
+                
+                # El turno se confirma automáticamente (sin necesidad de pago)
+                nuevo_turno.estado = EstadoTurno.CONFIRMADO
+                
+                db.session.commit()
+                
+                flash(f'¡Turno agendado con éxito! Consultas restantes: {consultas_despues}', 'success')
+                
+            else:
+                # ❌ NO TIENE PREPAGA O SE QUEDÓ SIN CONSULTAS
+                
+                # Calcular costo con descuento por grupo familiar
+                costo = calcular_costo_grupo_familiar(paciente_id)
+                
+                # Crear pago asociado
+                nuevo_pago = Pago(
+                    turno_id=nuevo_turno.id,
+                    monto=costo,
+                    estado=EstadoPago.PENDIENTE
+                )
+                
+                db.session.add(nuevo_pago)
+                db.session.commit()
+                
+                if suscripcion and not suscripcion.tiene_consultas_disponibles():
+                    flash('Se agotaron sus consultas de prepaga. Debe abonar esta consulta.', 'warning')
+                else:
+                    flash('Turno agendado. Debe subir el comprobante de pago para confirmar.', 'success')
+            
+            return redirect(url_for('mis_turnos'))
+            
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ese horario ya está ocupado para este especialista', 'danger')
+            return redirect(url_for('nuevo_turno'))
+        except ValueError as ve:
+            db.session.rollback()
+            flash(f'Error en el formato de fecha u hora: {str(ve)}', 'danger')
+            return redirect(url_for('nuevo_turno'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear turno: {str(e)}', 'danger')
+            return redirect(url_for('nuevo_turno'))
+    
+    # GET - Cargar datos para el formulario
+    especialidades = obtener_especialidades_activas()
+    grupo_familiar = GrupoFamiliar.query.filter_by(
+        usuario_id=session['user_id'],
+        activo=True
+    ).all()
+    
+    # Obtener suscripción si existe
+    suscripcion = SuscripcionPrepaga.query.filter_by(
+        usuario_id=session['user_id'],
+        estado=EstadoSuscripcion.ACTIVA
+    ).first()
+    
+    return render_template('turnos_nuevo.html',
+                         especialidades=especialidades,
+                         grupo_familiar=grupo_familiar,
+                         suscripcion=suscripcion,
+                         today=date.today().isoformat())
+
+# AGREGAR ESTA NUEVA RUTA PARA EL DASHBOARD:
+
+@app.route('/dashboard')
+@login_required
+def dashboard_user():
+    usuario = db.session.get(Usuario, session['user_id'])
+    
+    # Turnos próximos (con las relaciones que usa la plantilla, para no
+    # disparar un SELECT por fila al renderizar)
+    turnos_proximos = Turno.query.options(
+        joinedload(Turno.especialidad),
+        joinedload(Turno.familiar),
+        selectinload(Turno.pago)
+    ).filter(
+        Turno.paciente_id == usuario.id,
+        Turno.fecha >= date.today(),
+        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+    ).order_by(Turno.fecha, Turno.hora).limit(5).all()
+    
+    # Pagos pendientes (solo si no tiene prepaga)
+    pagos_pendientes = Pago.query.options(
+        joinedload(Pago.turno).joinedload(Turno.especialidad)
+    ).join(Turno).filter(
+        Turno.paciente_id == usuario.id,
+        Pago.estado == EstadoPago.PENDIENTE
+    ).all()
+    
+    # Grupo familiar
+    grupo_familiar = GrupoFamiliar.query.filter_by(
+        usuario_id=usuario.id,
+        activo=True
+    ).all()
+    
+    # Suscripción de prepaga
+    suscripcion = SuscripcionPrepaga.query.options(
+        joinedload(SuscripcionPrepaga.plan)
+    ).filter_by(
+        usuario_id=usuario.id
+    ).filter(
+        SuscripcionPrepaga.estado.in_([EstadoSuscripcion.ACTIVA, EstadoSuscripcion.PENDIENTE])
+    ).first()
+    
+    # Pago mensual pendiente (si tiene prepaga)
+    pago_mensual_pendiente = None
+    if suscripcion and suscripcion.estado == EstadoSuscripcion.ACTIVA:
+        hoy = date.today()
+        pago_mensual_pendiente = PagoMensualPrepaga.query.filter_by(
+            suscripcion_id=suscripcion.id,
+            mes=hoy.month,
+            anio=hoy.year
+        ).filter(
+            PagoMensualPrepaga.estado.in_([EstadoPagoMensual.PENDIENTE, EstadoPagoMensual.RECHAZADO])
+        ).first()
+    
+    return render_template('dashboard_user.html',
+                         usuario=usuario,
+                         turnos_proximos=turnos_proximos,
+                         pagos_pendientes=pagos_pendientes,
+                         grupo_familiar=grupo_familiar,
+                         suscripcion=suscripcion,
+                         pago_mensual_pendiente=pago_mensual_pendiente)
+
+# ACTUALIZAR EL COMANDO seed_db() PARA INCLUIR PLANES:
+
+@app.cli.command()
+def seed_db():
+    """Carga datos de ejemplo incluyendo planes de prepaga"""
+    
+    # Admin
+    admin = Usuario(
+        nombre="Admin",
+        apellido="Sistema",
+        dni="00000000",
+        email="admin@consultorio.com",
+        telefono="1234567890",
+        rol=RolUsuario.ADMIN
+    )
+    admin.set_password("admin123")
+    db.session.add(admin)
+    
+    # Especialidades
+    especialidades = [
+        Especialidad(nombre="Clínica Médica", costo_consulta=15000, duracion_turno=30),
+        Especialidad(nombre="Pediatría", costo_consulta=15000, duracion_turno=30),
+        Especialidad(nombre="Cardiología", costo_consulta=20000, duracion_turno=45),
+        Especialidad(nombre="Dermatología", costo_consulta=18000, duracion_turno=30),
+    ]
+    
+    for esp in especialidades:
+        db.session.add(esp)
+    
+    # Planes de Prepaga
+    planes = [
+        PlanPrepaga(
+            tipo=TipoPlan.INDIVIDUAL,
+            nombre="Plan Individual",
+            descripcion="Ideal para una persona",
+            precio_mensual=8000,
+            consultas_incluidas=10,
+            personas_maximas=1,
+            incluye_medico_online=False
+        ),
+        PlanPrepaga(
+            tipo=TipoPlan.PAREJA,
+            nombre="Plan Pareja",
+            descripcion="Para dos personas",
+            precio_mensual=14000,
+            consultas_incluidas=10,
+            personas_maximas=2,
+            incluye_medico_online=False
+        ),
+        PlanPrepaga(
+            tipo=TipoPlan.FAMILIAR,
+            nombre="Plan Familiar",
+            descripcion="Hasta 4 personas",
+            precio_mensual=24000,
+            consultas_incluidas=10,
+            personas_maximas=4,
+            incluye_medico_online=True
+        ),
+        PlanPrepaga(
+            tipo=TipoPlan.FAMILIAR_MAXI,
+            nombre="Plan Familiar Maxi",
+            descripcion="Más de 4 personas",
+            precio_mensual=32000,
+            consultas_incluidas=10,
+            personas_maximas=6,
+            incluye_medico_online=True
+        ),
+    ]
+    
+    for plan in planes:
+        db.session.add(plan)
+    
+    db.session.commit()
+    print("✅ Datos de ejemplo cargados (incluyendo planes de prepaga)")
+
+@app.route('/turnos/mis-turnos')
+@login_required
+def mis_turnos():
+    usuario_id = session['user_id']
+    
+    # Relaciones que recorre turnos.html; cargadas acá para que el
+    # render no dispare un SELECT por turno
+    _opciones_turno = (
+        joinedload(Turno.especialidad),
+        joinedload(Turno.familiar),
+        selectinload(Turno.pago)
+    )
+    
+    # Turnos pendientes
+    turnos_pendientes = Turno.query.options(*_opciones_turno, *_carga_estricta()).filter(
+        Turno.paciente_id == usuario_id,
+        Turno.fecha >= date.today(),
+        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+    ).order_by(Turno.fecha, Turno.hora).all()
+    
+    # Turnos realizados
+    turnos_realizados = Turno.query.options(*_opciones_turno, *_carga_estricta()).filter(
+        Turno.paciente_id == usuario_id,
+        or_(
+            Turno.estado == EstadoTurno.REALIZADO,
+            and_(Turno.fecha < date.today(), Turno.estado != EstadoTurno.CANCELADO)
+        )
+    ).order_by(Turno.fecha.desc(), Turno.hora.desc()).limit(10).all()
+    
+    return render_template('turnos.html',
+                         turnos_pendientes=turnos_pendientes,
+                         turnos_realizados=turnos_realizados)
+
+@app.route('/turnos/cancelar/<int:turno_id>', methods=['POST'])
+@login_required
+def cancelar_turno(turno_id):
+    # session.get pega primero en el identity map y evita el armado de Query
+    turno = db.session.get(Turno, turno_id)
+    if turno is None:
+        abort(404)
+    
+    # Verificar que el turno pertenece al usuario
+    if turno.paciente_id != session['user_id']:
+        flash('No tiene permisos para cancelar este turno', 'danger')
+        return redirect(url_for('mis_turnos'))
+    
+    # No se puede cancelar si ya está realizado
+    if turno.estado == EstadoTurno.REALIZADO:
+        flash('No se puede cancelar un turno ya realizado', 'danger')
+        return redirect(url_for('mis_turnos'))
+    
+    turno.estado = EstadoTurno.CANCELADO
+    
+    # Si había pago asociado, cambiar estado
+    if turno.pago:
+        turno.pago.observaciones = "Turno cancelado por el paciente"
+    
+    db.session.commit()
+    flash('Turno cancelado correctamente', 'info')
+    return redirect(url_for('mis_turnos'))
+
+# ==================== PAGOS ====================
+
+@app.route('/pagos/subir-comprobante/<int:turno_id>', methods=['GET', 'POST'])
+@login_required
+def subir_comprobante(turno_id):
+    # session.get pega primero en el identity map y evita el armado de Query
+    turno = db.session.get(Turno, turno_id)
+    if turno is None:
+        abort(404)
+    
+    # Verificar que el turno pertenece al usuario
+    if turno.paciente_id != session['user_id']:
+        flash('No tiene permisos para este turno', 'danger')
+        return redirect(url_for('mis_turnos'))
+    
+    if not turno.pago:
+        flash('Este turno no tiene pago asociado', 'danger')
+        return redirect(url_for('mis_turnos'))
+    
+    if request.method == 'POST':
+        try:
+            if 'comprobante' not in request.files:
+                flash('No se seleccionó ningún archivo', 'danger')
+                return redirect(request.url)
+            
+            archivo = request.files['comprobante']
+            
+            if archivo.filename == '':
+                flash('No se seleccionó ningún archivo', 'danger')
+                return redirect(request.url)
+            
+            if not allowed_file(archivo.filename):
+                flash('Formato de archivo no permitido. Use JPG, PNG o PDF', 'danger')
+                return redirect(request.url)
+            
+            # Leer y comprimir archivo
+            archivo_bytes = archivo.read()
+            
+            if len(archivo_bytes) > app.config['MAX_CONTENT_LENGTH']:
+                flash('El archivo es demasiado grande (máximo 5MB)', 'danger')
+                return redirect(request.url)
+            
+            # JPG/PNG/PDF ya están comprimidos internamente: pasarlos por
+            # el compresor quema CPU para ganar ~0% de tamaño
+            tipo_archivo = archivo.content_type or ''
+            if tipo_archivo.startswith('image/') or tipo_archivo == 'application/pdf':
+                archivo_guardado = archivo_bytes
+                compresion = 'none'
+            else:
+                archivo_guardado = comprimir_archivo(archivo_bytes)
+                compresion = 'zstd'
+            
+            # Con almacenamiento externo habilitado el archivo va a disco
+            # y la fila guarda solo la clave; si no, a la base como siempre
+            pago = turno.pago
+            if almacenamiento.habilitado():
+                pago.comprobante_clave = almacenamiento.guardar(archivo_guardado)
+                pago.comprobante = None
+            else:
+                pago.comprobante = archivo_guardado
+                pago.comprobante_clave = None
+            pago.comprobante_compresion = compresion
+            pago.comprobante_nombre = archivo.filename
+            pago.comprobante_tipo = archivo.content_type
+            pago.fecha_subida = datetime.utcnow()
+            pago.estado = EstadoPago.PENDIENTE  # Cambiar a pendiente de aprobación
+            
+            db.session.commit()
+            
+            flash('Comprobante subido correctamente. En breve será revisado.', 'success')
+            return redirect(url_for('mis_turnos'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al subir comprobante: {str(e)}', 'danger')
+            return redirect(request.url)
+    
+    return render_template('subir_comprobante.html', turno=turno)
+
+@app.route('/pagos/ver-comprobante/<int:pago_id>')
+@login_required
+def ver_comprobante(pago_id):
+    # joinedload del turno: el chequeo de propietario lo necesita y así
+    # no dispara un segundo SELECT
+    pago = db.session.query(Pago).options(
+        joinedload(Pago.turno)
+    ).filter_by(id=pago_id).one_or_none()
+    if pago is None:
+        abort(404)
+
+    # Verificar permisos. El rol viaja en la sesión desde el login: no
+    # hace falta un SELECT de Usuario solo para decidir si es admin
+    es_propietario = pago.turno.paciente_id == session['user_id']
+    es_admin = session.get('user_rol') in ('admin', 'recepcion')
+    
+    if not (es_propietario or es_admin):
+        flash('No tiene permisos para ver este comprobante', 'danger')
+        return redirect(url_for('index'))
+    
+    if not (pago.comprobante_clave or pago.comprobante):
+        flash('No hay comprobante asociado a este pago', 'warning')
+        return redirect(url_for('mis_turnos'))
+
+    try:
+        # Con clave, el blob vive en el almacenamiento externo; sin clave
+        # sale del LargeBinary de la fila (deferred, se carga acá)
+        if pago.comprobante_clave:
+            blob = almacenamiento.leer(pago.comprobante_clave)
+        else:
+            blob = pago.comprobante
+
+        # Stream de descompresión: el archivo se descomprime de a chunks
+        # mientras se escribe la respuesta, sin duplicar el blob en RAM
+        if pago.comprobante_compresion == 'none':
+            archivo = io.BytesIO(blob)
+        else:
+            archivo = abrir_archivo(blob)
+        
+        # Determinar tipo MIME
+        if pago.comprobante_tipo:
+            mime_type = pago.comprobante_tipo
+        else:
+            # Inferir por extensión
+            ext = pago.comprobante_nombre.rsplit('.', 1)[1].lower()
+            mime_type = _MIME_POR_EXTENSION.get(ext, 'application/octet-stream')
+        
+        # Si el cliente acepta la codificación en la que el blob ya está
+        # guardado, se sirve tal cual con Content-Encoding y descomprime
+        # el navegador: cero CPU de descompresión en el servidor.
+        # accept_encodings parsea los q-values: 'zstd;q=0' es un rechazo
+        # explícito, no una aceptación
+        if pago.comprobante_compresion != 'none':
+            codificacion, cuerpo = contenido_codificado(blob)
+            if request.accept_encodings.quality(codificacion) > 0:
+                respuesta = app.response_class(cuerpo, mimetype=mime_type)
+                respuesta.headers['Content-Encoding'] = codificacion
+                respuesta.headers['Vary'] = 'Accept-Encoding'
+                respuesta.headers['Content-Disposition'] = (
+                    f'inline; filename="{pago.comprobante_nombre}"'
+                )
+                archivo = None
+        
+        if archivo is not None:
+            respuesta = send_file(
+                archivo,
+                mimetype=mime_type,
+                as_attachment=False,
+                download_name=pago.comprobante_nombre
+            )
+        
+        # El comprobante no cambia una vez subido: con ETag + Cache-Control
+        # las revisiones repetidas del mismo archivo responden 304 sin
+        # volver a descomprimir ni transferir el blob
+        respuesta.set_etag(hashlib.sha1(blob).hexdigest())
+        respuesta.headers['Cache-Control'] = 'private, max-age=3600'
+        return respuesta.make_conditional(request)
+        
+    except Exception as e:
+        flash(f'Error al recuperar comprobante: {str(e)}', 'danger')
+        return redirect(url_for('mis_turnos'))
+
+@app.route('/pagos/mis-pagos')
+@login_required
+def mis_pagos():
+    usuario_id = session['user_id']
+    
+    pagina = request.args.get('page', 1, type=int)
+    paginacion = db.paginate(
+        db.select(Pago).options(
+            contains_eager(Pago.turno).joinedload(Turno.especialidad)
+        ).join(Turno).filter(
+            Turno.paciente_id == usuario_id
+        ).order_by(Pago.fecha_creacion.desc()),
+        page=pagina, per_page=25, error_out=False
+    )
+    
+    return render_template('pagos.html', pagos=paginacion.items, paginacion=paginacion)
+
+# ==================== HISTORIAL ====================
+
+@app.route('/historial')
+@login_required
+def historial():
+    usuario_id = session['user_id']
+
+    grupo_familiar = GrupoFamiliar.query.filter_by(
+        usuario_id=usuario_id,
+        activo=True
+    ).all()
+
+    # Un solo query trae el historial completo (titular + familiares) y
+    # se agrupa en Python; antes se emitía un SELECT por familiar.
+    # Cubierto por ix_turno_paciente_fecha_estado.
+    turnos = Turno.query.options(
+        joinedload(Turno.especialidad),
+        joinedload(Turno.especialista)
+    ).filter(
+        Turno.paciente_id == usuario_id,
+        Turno.estado == EstadoTurno.REALIZADO
+    ).order_by(Turno.fecha.desc()).all()
+
+    turnos_titular = [t for t in turnos if t.familiar_id is None]
+
+    por_familiar = {}
+    for turno in turnos:
+        if turno.familiar_id is not None:
+            por_familiar.setdefault(turno.familiar_id, []).append(turno)
+
+    historial_familiar = {
+        familiar: por_familiar[familiar.id]
+        for familiar in grupo_familiar if familiar.id in por_familiar
+    }
+
+    return render_template('historial.html',
+                         turnos_titular=turnos_titular,
+                         historial_familiar=historial_familiar)
+
+@app.route('/historial/descargar-pdf/<int:persona_id>')
+@login_required
+def descargar_historial_pdf(persona_id):
+    """Genera PDF del historial (simplificado - requiere librería adicional)"""
+    # Aquí iría la lógica con reportlab o weasyprint
+    flash('Funcionalidad de PDF en desarrollo', 'info')
+    return redirect(url_for('historial'))
+
+
+# ==================== DASHBOARD ADMIN ====================
+
+# Balance del mes cacheado: adaptación en proceso de una vista
+# materializada. El agregado se calcula una vez con SUM(CASE) y se sirve
+# de memoria hasta que un Movimiento nuevo lo invalida (evento de mapper
+# abajo), en vez de escanear la tabla completa en cada carga del
+# dashboard. TTL de respaldo por si el insert entra por otro proceso.
+_TTL_BALANCE_MES = 300
+
+def obtener_balance_mes():
+    """(ingresos, egresos) del mes calendario en curso."""
+    mes_actual = date.today().replace(day=1)
+    clave = f'balance_mes:{mes_actual.isoformat()}'
+    totales = cache.obtener(clave)
+    if totales is None:
+        fila = db.session.query(
+            func.coalesce(func.sum(case(
+                (Movimiento.tipo == TipoMovimiento.INGRESO, Movimiento.monto),
+                else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (Movimiento.tipo == TipoMovimiento.EGRESO, Movimiento.monto),
+                else_=0
+            )), 0)
+        ).filter(Movimiento.fecha >= mes_actual).one()
+        totales = (fila[0], fila[1])
+        cache.guardar(clave, totales, ttl=_TTL_BALANCE_MES)
+    return totales
+
+
+@event.listens_for(Movimiento, 'after_insert')
+def _invalidar_balance_mes(mapper, connection, target):
+    cache.invalidar(f'balance_mes:{date.today().replace(day=1).isoformat()}')
+
+@app.route('/admin/dashboard')
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def dashboard_admin():
+    # Turnos del día
+    turnos_hoy = Turno.query.options(
+        *Turno.CARGA_LISTADO,
+        *_carga_estricta()
+    ).filter(
+        Turno.fecha == date.today()
+    ).order_by(Turno.hora).all()
+    
+    # Los tres contadores de pendientes salen en un solo round trip como
+    # subqueries escalares (son tablas distintas, no se pueden sumar con
+    # un único COUNT(CASE))
+    pagos_pendientes, solicitudes_prepaga_count, pagos_mensuales_count = db.session.execute(
+        db.select(
+            db.select(func.count()).select_from(Pago).filter(
+                Pago.estado == EstadoPago.PENDIENTE,
+                or_(Pago.comprobante.isnot(None),
+                    Pago.comprobante_clave.isnot(None))
+            ).scalar_subquery(),
+            db.select(func.count()).select_from(SuscripcionPrepaga).filter(
+                SuscripcionPrepaga.estado == EstadoSuscripcion.PENDIENTE
+            ).scalar_subquery(),
+            db.select(func.count()).select_from(PagoMensualPrepaga).filter(
+                PagoMensualPrepaga.estado == EstadoPagoMensual.PENDIENTE,
+                or_(PagoMensualPrepaga.comprobante.isnot(None),
+                    PagoMensualPrepaga.comprobante_clave.isnot(None))
+            ).scalar_subquery()
+        ),
+        bind_arguments=_bind_lectura()
+    ).one()
+
+    # Balance del mes (agregado cacheado, ver obtener_balance_mes)
+    ingresos_mes, egresos_mes = obtener_balance_mes()
+    balance = ingresos_mes - egresos_mes
+
+    return render_template('dashboard_admin.html',
+                         turnos_hoy=turnos_hoy,
+                         pagos_pendientes=pagos_pendientes,
+                         solicitudes_prepaga_count=solicitudes_prepaga_count,
+                         pagos_mensuales_count=pagos_mensuales_count,
+                         ingresos_mes=ingresos_mes,
+                         egresos_mes=egresos_mes,
+                         balance=balance)
+
+@app.route('/admin/buscar-paciente', methods=['GET', 'POST'])
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def buscar_paciente():
+    if request.method == 'POST':
+        dni = request.form.get('dni')
+        
+        usuario = Usuario.query.filter_by(dni=dni).first()
+        
+        if not usuario:
+            flash('No se encontró paciente con ese DNI', 'warning')
+            return render_template('buscar_paciente.html', usuario=None)
+        
+        # Turnos del paciente
+        turnos = Turno.query.filter_by(paciente_id=usuario.id).order_by(
+            Turno.fecha.desc(), Turno.hora.desc()
+        ).limit(10).all()
+        
+        return render_template('buscar_paciente.html',
+                             usuario=usuario,
+                             turnos=turnos)
+    
+    return render_template('buscar_paciente.html', usuario=None)
+
+# Un pago en cualquiera de estos estados ya generó su Movimiento de
+# ingreso: volver a procesarlo duplicaría la caja
+_ESTADOS_PAGO_PROCESADO = (EstadoPago.APROBADO, EstadoPago.ABONADO_EFECTIVO)
+
+def _acreditar_pago(pago_id, nuevo_estado, concepto):
+    """Acredita un pago y registra el ingreso, a prueba de doble click.
+
+    Toma el lock de la fila (FOR UPDATE; en SQLite es un no-op pero el
+    lock de escritura de la base cubre lo mismo) para que dos admins
+    aprobando a la vez no generen dos Movimientos. Devuelve el pago, o
+    None si otro request ya lo había procesado.
+    """
+    pago = db.session.query(Pago).filter_by(id=pago_id).with_for_update().one_or_none()
+    if pago is None:
+        abort(404)
+
+    if pago.estado in _ESTADOS_PAGO_PROCESADO:
+        db.session.rollback()
+        return None
+
+    pago.estado = nuevo_estado
+    pago.fecha_aprobacion = datetime.utcnow()
+    pago.aprobado_por = session['user_id']
+
+    # Confirmar turno
+    pago.turno.estado = EstadoTurno.CONFIRMADO
+
+    # Registrar ingreso
+    movimiento = Movimiento(
+        tipo=TipoMovimiento.INGRESO,
+        monto=pago.monto,
+        concepto=f"{concepto} - Turno {pago.turno_id}",
+        pago_id=pago.id,
+        usuario_registro=session['user_id']
+    )
+    db.session.add(movimiento)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Backstop del UNIQUE de movimientos.pago_id
+        db.session.rollback()
+        return None
+    return pago
+
+
+@app.route('/admin/marcar-abonado/<int:pago_id>', methods=['POST'])
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def marcar_abonado(pago_id):
+    pago = _acreditar_pago(pago_id, EstadoPago.ABONADO_EFECTIVO, 'Pago en efectivo')
+
+    if pago is None:
+        flash('Este pago ya fue procesado', 'info')
+    else:
+        flash('Pago registrado como abonado en efectivo', 'success')
+    return redirect(request.referrer or url_for('dashboard_admin'))
+
+@app.route('/admin/aprobar-pago/<int:pago_id>', methods=['POST'])
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def aprobar_pago(pago_id):
+    pago = _acreditar_pago(pago_id, EstadoPago.APROBADO, 'Pago transferencia')
+
+    if pago is None:
+        flash('Este pago ya fue procesado', 'info')
+    else:
+        flash('Pago aprobado correctamente', 'success')
+    return redirect(url_for('revisar_pagos'))
+
+@app.route('/admin/rechazar-pago/<int:pago_id>', methods=['POST'])
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def rechazar_pago(pago_id):
+    pago = db.session.get(Pago, pago_id)
+    if pago is None:
+        abort(404)
+
+    observaciones = request.form.get('observaciones', 'Comprobante inválido')
+    
+    pago.estado = EstadoPago.RECHAZADO
+    pago.observaciones = observaciones
+    pago.aprobado_por = session['user_id']
+    
+    db.session.commit()
+    
+    flash('Pago rechazado', 'info')
+    return redirect(url_for('revisar_pagos'))
+
+@app.route('/admin/pagos')
+@role_required(RolUsuario.ADMIN, RolUsuario.RECEPCION)
+def revisar_pagos():
+    # Pagos pendientes
+    _opciones_pago = (
+        joinedload(Pago.turno).joinedload(Turno.paciente),
+        joinedload(Pago.turno).joinedload(Turno.especialidad)
+    )
+    
+    pagina = request.args.get('page', 1, type=int)
+    paginacion = db.paginate(
+        db.select(Pago).options(*_opciones_pago).filter(
+            Pago.estado == EstadoPago.PENDIENTE,
+            or_(Pago.comprobante.isnot(None),
+                Pago.comprobante_clave.isnot(None))
+        ).order_by(Pago.fecha_subida.desc()),
+        page=pagina, per_page=25, error_out=False
+    )
+    pagos_pendientes = paginacion.items
+    
+    # Pagos recientes
+    pagos_recientes = Pago.query.options(*_opciones_pago).filter(
+        Pago.estado.in_([EstadoPago.APROBADO, EstadoPago.RECHAZADO, EstadoPago.ABONADO_EFECTIVO])
+    ).order_by(Pago.fecha_aprobacion.desc()).limit(20).all()
+    
+    return render_template('admin_pagos.html',
+                         pagos_pendientes=pagos_pendientes,
+                         paginacion=paginacion,
+                         pagos_recientes=pagos_recientes)
+
+# ==================== MOVIMIENTOS ====================
+
+@app.route('/admin/movimientos')
+@role_required(RolUsuario.ADMIN)
+def ver_movimientos():
+    # Filtros
+    fecha_desde = request.args.get('fecha_desde')
+    fecha_hasta = request.args.get('fecha_hasta')
+    tipo = request.args.get('tipo')
+    
+    filtros = []
+
+    # fromisoformat parsea el formato del <input type="date"> varias veces
+    # más rápido que strptime (no interpreta el string de formato)
+    try:
+        if fecha_desde:
+            filtros.append(Movimiento.fecha >= datetime.fromisoformat(fecha_desde))
+        if fecha_hasta:
+            filtros.append(Movimiento.fecha <= datetime.fromisoformat(fecha_hasta))
+    except ValueError:
+        flash('Fecha de filtro inválida', 'warning')
+        return redirect(url_for('ver_movimientos'))
+    if tipo:
+        filtros.append(Movimiento.tipo == TipoMovimiento[tipo.upper()])
+    
+    pagina = request.args.get('page', 1, type=int)
+    paginacion = db.paginate(
+        db.select(Movimiento).filter(*filtros).order_by(Movimiento.fecha.desc()),
+        page=pagina, per_page=25, error_out=False
+    )
+    movimientos = paginacion.items
+    
+    # Totales agregados por la base con SUM(CASE ...): no hace falta
+    # recorrer las filas en Python ni traerlas todas para sumar
+    # Lectura pura: va a la réplica si el deployment la configuró
+    total_ingresos, total_egresos = db.session.execute(
+        db.select(
+            func.coalesce(func.sum(case(
+                (Movimiento.tipo == TipoMovimiento.INGRESO, Movimiento.monto), else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (Movimiento.tipo == TipoMovimiento.EGRESO, Movimiento.monto), else_=0
+            )), 0)
+        ).filter(*filtros),
+        bind_arguments=_bind_lectura()
+    ).one()
+    balance = total_ingresos - total_egresos
+    
+    return render_template('movimientos.html',
+                         movimientos=movimientos,
+                         paginacion=paginacion,
+                         total_ingresos=total_ingresos,
+                         total_egresos=total_egresos,
+                         balance=balance)
+
+@app.route('/admin/movimientos/nuevo', methods=['GET', 'POST'])
+@role_required(RolUsuario.ADMIN)
+def nuevo_movimiento():
+    if request.method == 'POST':
+        try:
+            tipo = TipoMovimiento[request.form.get('tipo').upper()]
+            monto = float(request.form.get('monto'))
+            concepto = request.form.get('concepto')
+            descripcion = request.form.get('descripcion')
+            
+            movimiento = Movimiento(
+                tipo=tipo,
+                monto=monto,
+                concepto=concepto,
+                descripcion=descripcion,
+                usuario_registro=session['user_id']
+            )
+            
+            db.session.add(movimiento)
+            db.session.commit()
+            
+            flash('Movimiento registrado correctamente', 'success')
+            return redirect(url_for('ver_movimientos'))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al registrar movimiento: {str(e)}', 'danger')
+    
+    return render_template('movimiento_nuevo.html')
+
+# ==================== DASHBOARD ESPECIALISTA ====================
+
+@app.route('/especialista/dashboard')
+@role_required(RolUsuario.ESPECIALISTA)
+def dashboard_especialista():
+    especialista_id = session['user_id']
+    
+    # Turnos de hoy
+    turnos_hoy = Turno.query.filter(
+        Turno.especialista_id == especialista_id,
+        Turno.fecha == date.today()
+    ).order_by(Turno.hora).all()
+    
+    # Próximos turnos
+    turnos_proximos = Turno.query.filter(
+        Turno.especialista_id == especialista_id,
+        Turno.fecha > date.today(),
+        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+    ).order_by(Turno.fecha, Turno.hora).limit(10).all()
+    
+    return render_template('dashboard_especialista.html',
+                         turnos_hoy=turnos_hoy,
+                         turnos_proximos=turnos_proximos)
+
+
+# Las asignaciones especialista-especialidad solo cambian cuando un admin
+# crea o edita un especialista, así que el dropdown del formulario de
+# turnos se sirve desde cache (se invalida desde admin_routes)
+_TTL_ESPECIALISTAS = 300
+
+def obtener_especialistas_de_especialidad(especialidad_id):
+    """Lista de especialistas activos de una especialidad, como dicts planos."""
+    clave = f'especialistas:{especialidad_id}'
+    especialistas = cache.obtener(clave)
+    if especialistas is None:
+        filas = db.session.query(Usuario.id, Usuario.nombre, Usuario.apellido).join(
+            EspecialistaEspecialidad,
+            EspecialistaEspecialidad.especialista_id == Usuario.id
+        ).filter(
+            EspecialistaEspecialidad.especialidad_id == especialidad_id,
+            EspecialistaEspecialidad.activo == True
+        ).all()
+        especialistas = [
+            {'id': fila.id, 'nombre': f"{fila.nombre} {fila.apellido}"}
+            for fila in filas
+        ]
+        cache.guardar(clave, especialistas, ttl=_TTL_ESPECIALISTAS)
+    return especialistas
+
+
+@app.route('/api/especialistas-por-especialidad')
+@login_required
+def especialistas_por_especialidad():
+    especialidad_id = request.args.get('especialidad_id')
+    if not especialidad_id:
+        return {'error': 'Faltan parámetros'}, 400
+
+    return {
+        'especialistas': obtener_especialistas_de_especialidad(especialidad_id)
+    }
+
+@app.route('/api/turnos/horarios-disponibles')
+@login_required
+def horarios_disponibles():
+    especialista_id = request.args.get('especialista_id')
+    especialidad_id = request.args.get('especialidad_id')
+    fecha_str = request.args.get('fecha')
+    
+    if not all([especialista_id, especialidad_id, fecha_str]):
+        return {'error': 'Faltan parámetros'}, 400
+    
+    # El form de reserva pega a este endpoint en cada cambio de fecha; los
+    # slots de un día solo cambian al reservar/cancelar un turno, así que
+    # se cachean. El prefijo 'slots:{especialista}:' es el mismo que usan
+    # las APIs del admin: el evento de mapper sobre Turno (admin_routes)
+    # invalida ambos caches en cada alta/baja
+    clave = f'slots:{especialista_id}:{especialidad_id}:{fecha_str}:horarios'
+    horarios_finales = cache.obtener(clave)
+
+    if horarios_finales is None:
+        fecha = date.fromisoformat(fecha_str)
+
+        # USAMOS TU GENERADOR DE TURNOS (Lógica del archivo turno_generator.py)
+        slots = GeneradorTurnos.obtener_slots_disponibles(
+            int(especialista_id),
+            int(especialidad_id),
+            fecha
+        )
+
+        # Filtramos solo los disponibles; el f-string formatea HH:MM sin pasar
+        # por el parser de formato de strftime en cada slot
+        horarios_finales = [
+            f"{s['hora_inicio'].hour:02d}:{s['hora_inicio'].minute:02d}"
+            for s in slots if s['disponible']
+        ]
+        cache.guardar(clave, horarios_finales, ttl=60)
+
+    return {'horarios': horarios_finales}
+
+@app.route('/especialista/atender-turno/<int:turno_id>', methods=['GET', 'POST'])
+@role_required(RolUsuario.ESPECIALISTA)
+def atender_turno(turno_id):
+    # session.get pega primero en el identity map y evita el armado de Query
+    turno = db.session.get(Turno, turno_id)
+    if turno is None:
+        abort(404)
+    
+    # Verificar que el turno es del especialista
+    if turno.especialista_id != session['user_id']:
+        flash('No tiene permisos para este turno', 'danger')
+        return redirect(url_for('dashboard_especialista'))
+    
+    if request.method == 'POST':
+        observaciones = request.form.get('observaciones')
+        
+        turno.observaciones = observaciones
+        turno.estado = EstadoTurno.REALIZADO
+        
+        db.session.commit()
+        
+        flash('Turno marcado como realizado', 'success')
+        return redirect(url_for('dashboard_especialista'))
+    
+    return render_template('atender_turno.html', turno=turno)
+
+# ==================== INICIALIZACIÓN ====================
+
+@app.cli.command()
+def init_db():
+    """Crea todas las tablas en la base de datos"""
+    db.create_all()
+    print("✅ Base de datos inicializada")
+
+@app.cli.command('generar-pagos-mensuales')
+def generar_pagos_mensuales():
+    """Genera el pago del mes próximo para todas las suscripciones activas.
+
+    Pensado para correr una vez por mes (cron). Un solo INSERT masivo
+    vía bulk_insert_mappings en lugar de un add/commit por suscripción.
+    """
+    hoy = date.today()
+    if hoy.month == 12:
+        mes, anio = 1, hoy.year + 1
+    else:
+        mes, anio = hoy.month + 1, hoy.year
+
+    ultimo_dia = monthrange(anio, mes)[1]
+    fecha_venc = date(anio, mes, min(10, ultimo_dia))
+
+    # Suscripciones que ya tienen el pago del período (re-ejecución segura)
+    ya_generadas = {
+        s_id for (s_id,) in db.session.query(
+            PagoMensualPrepaga.suscripcion_id
+        ).filter_by(mes=mes, anio=anio)
+    }
+
+    filas = [
+        {
+            'suscripcion_id': susc_id,
+            'mes': mes,
+            'anio': anio,
+            'monto': precio,
+            'fecha_vencimiento': fecha_venc,
+            'estado': EstadoPagoMensual.PENDIENTE,
+        }
+        for susc_id, precio in db.session.query(
+            SuscripcionPrepaga.id, PlanPrepaga.precio_mensual
+        ).join(SuscripcionPrepaga.plan).filter(
+            SuscripcionPrepaga.estado == EstadoSuscripcion.ACTIVA
+        )
+        if susc_id not in ya_generadas
+    ]
+
+    if filas:
+        db.session.bulk_insert_mappings(PagoMensualPrepaga, filas)
+        db.session.commit()
+
+    print(f"✅ {len(filas)} pagos generados para {mes}/{anio}")
+
+# @app.cli.command()
+# def seed_db():
+#     """Carga datos de ejemplo"""
+    
+#     # Admin
+#     admin = Usuario(
+#         nombre="Admin",
+#         apellido="Sistema",
+#         dni="00000000",
+#         email="admin@consultorio.com",
+#         telefono="1234567890",
+#         rol=RolUsuario.ADMIN
+#     )
+#     admin.set_password("admin123")
+#     db.session.add(admin)
+    
+#     # Especialidades
+#     especialidades = [
+#         Especialidad(nombre="Clínica Médica", costo_consulta=15000, duracion_turno=30),
+#         Especialidad(nombre="Pediatría", costo_consulta=15000, duracion_turno=30),
+#         Especialidad(nombre="Cardiología", costo_consulta=20000, duracion_turno=45),
+#         Especialidad(nombre="Dermatología", costo_consulta=18000, duracion_turno=30),
+#     ]
+    
+#     for esp in especialidades:
+#         db.session.add(esp)
+    
+#     db.session.commit()
+#     print("✅ Datos de ejemplo cargados")
+
+if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import threading
+import time
+
+# Cache en memoria para datos de referencia que cambian poco
+# (especialidades, planes, configuración). Cada proceso tiene su propia
+# copia: la invalidación es local, por eso los TTL son cortos.
+
+class CacheTTL:
+    """Cache clave/valor thread-safe con vencimiento por entrada"""
+
+    def __init__(self, ttl_default=300):
+        self.ttl_default = ttl_default
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        """Devuelve el valor cacheado o None si no existe o venció"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            vence, valor = entrada
+            if time.monotonic() >= vence:
+                del self._datos[clave]
+                return None
+            return valor
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda un valor con su tiempo de vida en segundos"""
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + (ttl or self.ttl_default), valor)
+
+    def invalidar(self, clave=None):
+        """Elimina una clave, o todo el cache si no se indica ninguna"""
+        with self._lock:
+            if clave is None:
+                self._datos.clear()
+            else:
+                self._datos.pop(clave, None)
+
+    def invalidar_prefijo(self, prefijo):
+        """Elimina todas las claves que empiecen con el prefijo dado"""
+        with self._lock:
+            for clave in [c for c in self._datos if c.startswith(prefijo)]:
+                del self._datos[clave]
+
+
+# Instancia compartida por toda la aplicación
+cache = CacheTTL()
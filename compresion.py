@@ -0,0 +1,84 @@
+# compresion.py
+# Compresión de los blobs almacenados (comprobantes de pagos y prepaga).
+#
+# zstd nivel 3 rinde como gzip-6 en tamaño pero comprime y descomprime
+# varias veces más rápido. Los blobs nuevos llevan un byte de versión al
+# frente; los viejos (gzip puro) se reconocen por no tenerlo.
+import gzip
+import io
+
+import zstandard as zstd
+
+_ZSTD_TAG = b'\x01'
+_ZSTD_COMPRESOR = zstd.ZstdCompressor(level=3)
+
+
+def comprimir_archivo(archivo_bytes):
+    """Comprime un archivo para almacenarlo (zstd con byte de versión)"""
+    return _ZSTD_TAG + _ZSTD_COMPRESOR.compress(archivo_bytes)
+
+
+def descomprimir_archivo(archivo_comprimido):
+    """Descomprime un blob guardado (zstd nuevo o gzip legado)"""
+    if archivo_comprimido[:1] == _ZSTD_TAG:
+        # decompressobj no exige que el frame declare su tamaño (los
+        # frames de comprimir_stream no lo traen) y es por llamada, así
+        # que no comparte estado entre threads
+        return zstd.ZstdDecompressor().decompressobj().decompress(archivo_comprimido[1:])
+    return gzip.decompress(archivo_comprimido)
+
+
+_CHUNK_SUBIDA = 64 * 1024
+
+
+def comprimir_stream(origen, limite=None):
+    """Comprime un stream de lectura a un blob zstd con byte de versión.
+
+    Lee de a chunks de 64KB: el archivo crudo nunca se materializa
+    completo en memoria, solo el comprimido. Si limite (en bytes) se
+    supera durante la lectura devuelve None.
+    """
+    buf = io.BytesIO()
+    buf.write(_ZSTD_TAG)
+    total = 0
+    # Compresor propio por stream: las sesiones de escritura no son
+    # compartibles entre threads
+    with zstd.ZstdCompressor(level=3).stream_writer(buf, closefd=False) as compresor:
+        while True:
+            chunk = origen.read(_CHUNK_SUBIDA)
+            if not chunk:
+                break
+            total += len(chunk)
+            if limite is not None and total > limite:
+                return None
+            compresor.write(chunk)
+    return buf.getvalue()
+
+
+def abrir_archivo(archivo_comprimido):
+    """Descomprime un blob como stream de lectura.
+
+    A diferencia de descomprimir_archivo no materializa el archivo
+    completo: el file-like devuelto descomprime de a chunks a medida que
+    la respuesta se escribe, con memoria acotada por chunk.
+    """
+    if archivo_comprimido[:1] == _ZSTD_TAG:
+        # Descompresor propio por stream: las sesiones de lectura no son
+        # compartibles entre threads
+        return zstd.ZstdDecompressor().stream_reader(
+            io.BytesIO(archivo_comprimido[1:])
+        )
+    return gzip.GzipFile(fileobj=io.BytesIO(archivo_comprimido))
+
+
+def contenido_codificado(archivo_comprimido):
+    """Bytes listos para servir con Content-Encoding, sin descomprimir.
+
+    Devuelve ('zstd', payload) para los blobs nuevos (sin el byte de
+    versión: lo que queda es un frame zstd válido) o ('gzip', blob) para
+    los legados. Si el cliente acepta esa codificación el archivo viaja
+    tal como está guardado y la descompresión corre en el navegador.
+    """
+    if archivo_comprimido[:1] == _ZSTD_TAG:
+        return 'zstd', archivo_comprimido[1:]
+    return 'gzip', archivo_comprimido
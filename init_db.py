@@ -12,19 +12,17 @@ with app.app_context():
     print("📦 Creando tablas nuevas...")
     db.create_all()
     
-    # Crear especialidades
+    # Crear especialidades: un solo executemany en lugar de un INSERT
+    # por objeto vía unit-of-work
     print("⚕️  Insertando especialidades...")
-    especialidades = [
-        Especialidad(nombre="Clínica Médica", costo_consulta=15000, duracion_turno=30),
-        Especialidad(nombre="Pediatría", costo_consulta=15000, duracion_turno=30),
-        Especialidad(nombre="Cardiología", costo_consulta=20000, duracion_turno=45),
-        Especialidad(nombre="Dermatología", costo_consulta=18000, duracion_turno=30),
-        Especialidad(nombre="Traumatología", costo_consulta=18000, duracion_turno=30),
-        Especialidad(nombre="Ginecología", costo_consulta=20000, duracion_turno=45),
-    ]
-    
-    for esp in especialidades:
-        db.session.add(esp)
+    db.session.execute(db.insert(Especialidad), [
+        {"nombre": "Clínica Médica", "costo_consulta": 15000, "duracion_turno": 30},
+        {"nombre": "Pediatría", "costo_consulta": 15000, "duracion_turno": 30},
+        {"nombre": "Cardiología", "costo_consulta": 20000, "duracion_turno": 45},
+        {"nombre": "Dermatología", "costo_consulta": 18000, "duracion_turno": 30},
+        {"nombre": "Traumatología", "costo_consulta": 18000, "duracion_turno": 30},
+        {"nombre": "Ginecología", "costo_consulta": 20000, "duracion_turno": 45},
+    ])
     
     # Crear usuario admin
     print("👤 Creando usuario administrador...")
@@ -1,176 +1,260 @@
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-import enum
-
-db = SQLAlchemy()
-
-# ENUMS
-class RolUsuario(enum.Enum):
-    PACIENTE = "paciente"
-    ESPECIALISTA = "especialista"
-    ADMIN = "admin"
-    RECEPCION = "recepcion"
-
-class EstadoTurno(enum.Enum):
-    PENDIENTE = "pendiente"
-    CONFIRMADO = "confirmado"
-    REALIZADO = "realizado"
-    CANCELADO = "cancelado"
-
-class EstadoPago(enum.Enum):
-    PENDIENTE = "pendiente"
-    APROBADO = "aprobado"
-    RECHAZADO = "rechazado"
-    ABONADO_EFECTIVO = "abonado_efectivo"
-
-class TipoMovimiento(enum.Enum):
-    INGRESO = "ingreso"
-    EGRESO = "egreso"
-
-# MODELOS
-
-class Usuario(db.Model):
-    __tablename__ = 'usuarios'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    nombre = db.Column(db.String(100), nullable=False)
-    apellido = db.Column(db.String(100), nullable=False)
-    dni = db.Column(db.String(20), unique=True, nullable=False, index=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    telefono = db.Column(db.String(20))
-    password_hash = db.Column(db.String(255), nullable=False)
-    rol = db.Column(db.Enum(RolUsuario), default=RolUsuario.PACIENTE, nullable=False)
-    activo = db.Column(db.Boolean, default=True)
-    fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relaciones
-    grupo_familiar = db.relationship('GrupoFamiliar', backref='titular', lazy=True, 
-                                     foreign_keys='GrupoFamiliar.usuario_id')
-    turnos = db.relationship('Turno', backref='paciente', lazy=True,
-                            foreign_keys='Turno.paciente_id')
-    turnos_atendidos = db.relationship('Turno', backref='especialista', lazy=True,
-                                       foreign_keys='Turno.especialista_id')
-    
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-    
-    def __repr__(self):
-        return f'<Usuario {self.nombre} {self.apellido} - {self.dni}>'
-
-class GrupoFamiliar(db.Model):
-    __tablename__ = 'grupo_familiar'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
-    nombre = db.Column(db.String(100), nullable=False)
-    apellido = db.Column(db.String(100), nullable=False)
-    dni = db.Column(db.String(20), nullable=False, index=True)
-    fecha_nacimiento = db.Column(db.Date)
-    parentesco = db.Column(db.String(50))
-    activo = db.Column(db.Boolean, default=True)
-    
-    def __repr__(self):
-        return f'<Familiar {self.nombre} {self.apellido} - DNI: {self.dni}>'
-
-class Especialidad(db.Model):
-    __tablename__ = 'especialidades'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    nombre = db.Column(db.String(100), nullable=False, unique=True)
-    descripcion = db.Column(db.Text)
-    direccion = db.Column(db.String(255))  # <--- AGREGAR ESTA LÍNEA
-    costo_consulta = db.Column(db.Numeric(10, 2), nullable=False)
-    duracion_turno = db.Column(db.Integer, default=30)
-    activo = db.Column(db.Boolean, default=True)
-    
-    turnos = db.relationship('Turno', backref='especialidad', lazy=True)
-    
-    def __repr__(self):
-        return f'<Especialidad {self.nombre}>'
-
-class Turno(db.Model):
-    __tablename__ = 'turnos'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    paciente_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
-    especialista_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), nullable=False)
-    
-    # Puede ser para el titular o un familiar
-    familiar_id = db.Column(db.Integer, db.ForeignKey('grupo_familiar.id'))
-    familiar = db.relationship('GrupoFamiliar', backref='turnos')
-    
-    fecha = db.Column(db.Date, nullable=False, index=True)
-    hora = db.Column(db.Time, nullable=False, index=True)
-    estado = db.Column(db.Enum(EstadoTurno), default=EstadoTurno.PENDIENTE, nullable=False)
-    
-    motivo_consulta = db.Column(db.Text)
-    observaciones = db.Column(db.Text)
-    
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    fecha_modificacion = db.Column(db.DateTime, onupdate=datetime.utcnow)
-    
-    # Relación con pagos
-    pago = db.relationship('Pago', backref='turno', uselist=False, lazy=True)
-    
-    def __repr__(self):
-        return f'<Turno {self.id} - {self.fecha} {self.hora}>'
-
-class Pago(db.Model):
-    __tablename__ = 'pagos'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    turno_id = db.Column(db.Integer, db.ForeignKey('turnos.id'), nullable=False, unique=True)
-    monto = db.Column(db.Numeric(10, 2), nullable=False)
-    estado = db.Column(db.Enum(EstadoPago), default=EstadoPago.PENDIENTE, nullable=False)
-    
-    # Comprobante comprimido
-    comprobante = db.Column(db.LargeBinary)  # Archivo comprimido
-    comprobante_nombre = db.Column(db.String(255))
-    comprobante_tipo = db.Column(db.String(50))
-    
-    observaciones = db.Column(db.Text)
-    fecha_subida = db.Column(db.DateTime)
-    fecha_aprobacion = db.Column(db.DateTime)
-    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    def __repr__(self):
-        return f'<Pago {self.id} - Turno {self.turno_id} - {self.estado.value}>'
-
-class Movimiento(db.Model):
-    __tablename__ = 'movimientos'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    tipo = db.Column(db.Enum(TipoMovimiento), nullable=False)
-    monto = db.Column(db.Numeric(10, 2), nullable=False)
-    concepto = db.Column(db.String(255), nullable=False)
-    descripcion = db.Column(db.Text)
-    
-    # Si es ingreso, puede estar vinculado a un pago
-    pago_id = db.Column(db.Integer, db.ForeignKey('pagos.id'))
-    
-    fecha = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    usuario_registro = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    
-    def __repr__(self):
-        return f'<Movimiento {self.tipo.value} - ${self.monto}>'
-
-class HorarioDisponible(db.Model):
-    __tablename__ = 'horarios_disponibles'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    especialista_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
-    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), nullable=False)
-    dia_semana = db.Column(db.Integer, nullable=False)  # 0=Lunes, 6=Domingo
-    hora_inicio = db.Column(db.Time, nullable=False)
-    hora_fin = db.Column(db.Time, nullable=False)
-    activo = db.Column(db.Boolean, default=True)
-    
-    def __repr__(self):
-        return f'<Horario Especialista {self.especialista_id} - Día {self.dia_semana}>'
\ No newline at end of file
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
+import enum
+import os
+
+# Método de hashing de contraseñas, ajustable por deployment sin tocar
+# código (ej: 'pbkdf2:sha256:260000' si el scrypt default satura CPU)
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+db = SQLAlchemy()
+
+# ENUMS
+# Las columnas Enum van como VARCHAR(20) (native_enum=False): el tipo
+# ENUM nativo de Postgres exige ALTER TYPE por cada valor nuevo y la
+# validación del lado SQLAlchemy es más liviana sobre strings.
+class RolUsuario(enum.Enum):
+    PACIENTE = "paciente"
+    ESPECIALISTA = "especialista"
+    ADMIN = "admin"
+    RECEPCION = "recepcion"
+
+class EstadoTurno(enum.Enum):
+    PENDIENTE = "pendiente"
+    CONFIRMADO = "confirmado"
+    REALIZADO = "realizado"
+    CANCELADO = "cancelado"
+
+class EstadoPago(enum.Enum):
+    PENDIENTE = "pendiente"
+    APROBADO = "aprobado"
+    RECHAZADO = "rechazado"
+    ABONADO_EFECTIVO = "abonado_efectivo"
+
+class TipoMovimiento(enum.Enum):
+    INGRESO = "ingreso"
+    EGRESO = "egreso"
+
+# MODELOS
+
+class Usuario(db.Model):
+    __tablename__ = 'usuarios'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    apellido = db.Column(db.String(100), nullable=False)
+    dni = db.Column(db.String(20), unique=True, nullable=False, index=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    telefono = db.Column(db.String(20))
+    password_hash = db.Column(db.String(255), nullable=False)
+    rol = db.Column(db.Enum(RolUsuario, native_enum=False, length=20), default=RolUsuario.PACIENTE, nullable=False, index=True)
+    activo = db.Column(db.Boolean, default=True)
+    fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relaciones
+    grupo_familiar = db.relationship('GrupoFamiliar', backref='titular', lazy=True, 
+                                     foreign_keys='GrupoFamiliar.usuario_id')
+    turnos = db.relationship('Turno', backref='paciente', lazy=True,
+                            foreign_keys='Turno.paciente_id')
+    turnos_atendidos = db.relationship('Turno', backref='especialista', lazy=True,
+                                       foreign_keys='Turno.especialista_id')
+    
+    # Búsqueda de login: índice parcial sobre dni limitado a cuentas
+    # activas (en Postgres; en SQLite queda como índice común)
+    __table_args__ = (
+        db.Index('ix_usuario_dni_activo', 'dni', postgresql_where=db.text('activo')),
+    )
+    
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+    
+    def __repr__(self):
+        return f'<Usuario {self.nombre} {self.apellido} - {self.dni}>'
+
+class GrupoFamiliar(db.Model):
+    __tablename__ = 'grupo_familiar'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    nombre = db.Column(db.String(100), nullable=False)
+    apellido = db.Column(db.String(100), nullable=False)
+    dni = db.Column(db.String(20), nullable=False, index=True)
+    fecha_nacimiento = db.Column(db.Date)
+    parentesco = db.Column(db.String(50))
+    activo = db.Column(db.Boolean, default=True)
+    
+    def __repr__(self):
+        return f'<Familiar {self.nombre} {self.apellido} - DNI: {self.dni}>'
+
+class Especialidad(db.Model):
+    __tablename__ = 'especialidades'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False, unique=True)
+    descripcion = db.Column(db.Text)
+    direccion = db.Column(db.String(255))  # <--- AGREGAR ESTA LÍNEA
+    costo_consulta = db.Column(db.Numeric(10, 2), nullable=False)
+    duracion_turno = db.Column(db.Integer, default=30)
+    activo = db.Column(db.Boolean, default=True)
+    
+    turnos = db.relationship('Turno', backref='especialidad', lazy=True)
+    
+    # Cubre el listado ordenado y el filtro de activas de los formularios
+    __table_args__ = (
+        db.Index('idx_especialidad_activo_nombre', 'activo', 'nombre'),
+    )
+    
+    def __repr__(self):
+        return f'<Especialidad {self.nombre}>'
+
+class Turno(db.Model):
+    __tablename__ = 'turnos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    especialista_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), nullable=False)
+    
+    # Puede ser para el titular o un familiar
+    familiar_id = db.Column(db.Integer, db.ForeignKey('grupo_familiar.id'))
+    familiar = db.relationship('GrupoFamiliar', backref='turnos')
+    
+    # Sin index=True sueltos: fecha ya encabeza ix_turno_fecha_estado y
+    # hora nunca se filtra sola; menos índices = menos costo por INSERT
+    fecha = db.Column(db.Date, nullable=False)
+    hora = db.Column(db.Time, nullable=False)
+    estado = db.Column(db.Enum(EstadoTurno, native_enum=False, length=20), default=EstadoTurno.PENDIENTE, nullable=False)
+    
+    motivo_consulta = db.Column(db.Text)
+    observaciones = db.Column(db.Text)
+    
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_modificacion = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    
+    # Relación con pagos
+    pago = db.relationship('Pago', backref='turno', uselist=False, lazy=True)
+    
+    # Índices compuestos para los filtros calientes: chequeo de
+    # disponibilidad al reservar y listado de turnos del paciente
+    __table_args__ = (
+        # Único parcial: dos turnos vivos no pueden compartir slot, pero un
+        # turno cancelado no bloquea que el horario se vuelva a reservar
+        db.Index(
+            'uq_turno_slot',
+            'especialista_id', 'fecha', 'hora',
+            unique=True,
+            postgresql_where=db.text("estado IN ('PENDIENTE', 'CONFIRMADO')"),
+            sqlite_where=db.text("estado IN ('PENDIENTE', 'CONFIRMADO')")
+        ),
+        db.Index('ix_turno_paciente_fecha_estado', 'paciente_id', 'fecha', 'estado'),
+        # Turnos del día en el dashboard admin: filtra por fecha y estado
+        db.Index('ix_turno_fecha_estado', 'fecha', 'estado'),
+        # Agenda del especialista (dashboard, atención): el único parcial
+        # de arriba no sirve para consultas que incluyen otros estados
+        db.Index('ix_turno_especialista_fecha', 'especialista_id', 'fecha', 'estado'),
+    )
+    
+    def __repr__(self):
+        return f'<Turno {self.id} - {self.fecha} {self.hora}>'
+
+class Pago(db.Model):
+    __tablename__ = 'pagos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    turno_id = db.Column(db.Integer, db.ForeignKey('turnos.id'), nullable=False, unique=True)
+    monto = db.Column(db.Numeric(10, 2), nullable=False)
+    estado = db.Column(db.Enum(EstadoPago, native_enum=False, length=20), default=EstadoPago.PENDIENTE, nullable=False)
+    
+    # Comprobante comprimido. Va deferred: los listados de pagos no lo
+    # necesitan y sin esto cada fila arrastraba el blob completo;
+    # ver_comprobante lo carga al acceder al atributo (una sola fila)
+    comprobante = db.deferred(db.Column(db.LargeBinary))
+    comprobante_nombre = db.Column(db.String(255))
+    comprobante_tipo = db.Column(db.String(50))
+    # 'none' = guardado tal cual (JPG/PNG/PDF ya vienen comprimidos);
+    # NULL = blob viejo comprimido con gzip/zstd
+    comprobante_compresion = db.Column(db.String(10))
+    # Clave en el almacenamiento externo de comprobantes (ver
+    # almacenamiento.py); con clave presente el LargeBinary queda NULL
+    comprobante_clave = db.Column(db.String(64))
+    
+    observaciones = db.Column(db.Text)
+    fecha_subida = db.Column(db.DateTime)
+    fecha_aprobacion = db.Column(db.DateTime)
+    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # revisar_pagos ordena los pendientes por fecha de subida; el índice
+    # parcial (en Postgres) cubre exactamente ese predicado. El OR con
+    # la clave externa replica el filtro de las vistas: sin él, con
+    # almacenamiento externo habilitado el predicado del índice dejaba
+    # de implicar al de la query y Postgres volvía al seq scan
+    __table_args__ = (
+        db.Index(
+            'ix_pago_estado_subida', 'estado', 'fecha_subida',
+            postgresql_where=db.text(
+                "estado = 'PENDIENTE' AND "
+                "(comprobante IS NOT NULL OR comprobante_clave IS NOT NULL)"
+            )
+        ),
+    )
+    
+    def __repr__(self):
+        return f'<Pago {self.id} - Turno {self.turno_id} - {self.estado.value}>'
+
+class Movimiento(db.Model):
+    __tablename__ = 'movimientos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.Enum(TipoMovimiento, native_enum=False, length=20), nullable=False)
+    monto = db.Column(db.Numeric(10, 2), nullable=False)
+    concepto = db.Column(db.String(255), nullable=False)
+    descripcion = db.Column(db.Text)
+    
+    # Si es ingreso, puede estar vinculado a un pago. UNIQUE: un pago
+    # genera a lo sumo un ingreso (backstop contra aprobaciones dobles);
+    # los egresos quedan con NULL, que no colisiona
+    pago_id = db.Column(db.Integer, db.ForeignKey('pagos.id'), unique=True)
+    
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    usuario_registro = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    
+    def __repr__(self):
+        return f'<Movimiento {self.tipo.value} - ${self.monto}>'
+
+class HorarioDisponible(db.Model):
+    __tablename__ = 'horarios_disponibles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    especialista_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    especialidad_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), nullable=False)
+    dia_semana = db.Column(db.Integer, nullable=False)  # 0=Lunes, 6=Domingo
+    hora_inicio = db.Column(db.Time, nullable=False)
+    hora_fin = db.Column(db.Time, nullable=False)
+    activo = db.Column(db.Boolean, default=True)
+    
+    def __repr__(self):
+        return f'<Horario Especialista {self.especialista_id} - Día {self.dia_semana}>'
+
+# Opciones de carga por defecto para los listados de turnos del admin:
+# cubren todo lo que recorren las plantillas (paciente, especialista,
+# especialidad, familiar y pago) sin que cada vista repita la tupla.
+# Se asignan afuera de la clase porque las options referencian los
+# backrefs de Turno, que existen recién al configurar los mappers; las
+# vistas del paciente siguen usando subconjuntos propios.
+from sqlalchemy.orm import configure_mappers
+configure_mappers()
+
+Turno.CARGA_LISTADO = (
+    joinedload(Turno.paciente),
+    joinedload(Turno.especialista),
+    joinedload(Turno.especialidad),
+    joinedload(Turno.familiar),
+    selectinload(Turno.pago),
+)
@@ -1,203 +1,260 @@
-from models import db
-from datetime import datetime, date
-import enum
-
-# ==================== ENUMS ====================
-
-class TipoPlan(enum.Enum):
-    INDIVIDUAL = "individual"
-    PAREJA = "pareja"
-    FAMILIAR = "familiar"
-    FAMILIAR_MAXI = "familiar_maxi"
-
-class EstadoSuscripcion(enum.Enum):
-    PENDIENTE = "pendiente"  # Solicitud enviada, esperando aprobación
-    ACTIVA = "activa"  # Suscripción aprobada y activa
-    SUSPENDIDA = "suspendida"  # Suspendida por falta de pago
-    CANCELADA = "cancelada"  # Cancelada por el usuario o admin
-    VENCIDA = "vencida"  # Periodo vencido
-
-class EstadoPagoMensual(enum.Enum):
-    PENDIENTE = "pendiente"  # Comprobante subido, esperando revisión
-    APROBADO = "aprobado"  # Pago aprobado
-    RECHAZADO = "rechazado"  # Pago rechazado
-    VENCIDO = "vencido"  # No se subió comprobante a tiempo
-
-# ==================== MODELOS ====================
-
-class PlanPrepaga(db.Model):
-    """
-    Definición de los planes de prepaga disponibles
-    """
-    __tablename__ = 'planes_prepaga'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    tipo = db.Column(db.Enum(TipoPlan), nullable=False, unique=True)
-    nombre = db.Column(db.String(100), nullable=False)
-    descripcion = db.Column(db.Text)
-    
-    # Costos y límites
-    precio_mensual = db.Column(db.Numeric(10, 2), nullable=False)
-    consultas_incluidas = db.Column(db.Integer, default=10)  # Por persona
-    personas_maximas = db.Column(db.Integer, default=1)  # 1=Individual, 2=Pareja, 4=Familiar, etc
-    
-    # Características especiales
-    incluye_medico_online = db.Column(db.Boolean, default=False)
-    
-    activo = db.Column(db.Boolean, default=True)
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relaciones
-    suscripciones = db.relationship('SuscripcionPrepaga', back_populates='plan', lazy='dynamic')
-    
-    def __repr__(self):
-        return f'<PlanPrepaga {self.nombre}>'
-
-
-class SuscripcionPrepaga(db.Model):
-    """
-    Suscripción de un usuario a un plan de prepaga
-    """
-    __tablename__ = 'suscripciones_prepaga'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
-    plan_id = db.Column(db.Integer, db.ForeignKey('planes_prepaga.id'), nullable=False)
-    
-    # Estado y fechas
-    estado = db.Column(db.Enum(EstadoSuscripcion), default=EstadoSuscripcion.PENDIENTE, nullable=False)
-    fecha_solicitud = db.Column(db.DateTime, default=datetime.utcnow)
-    fecha_aprobacion = db.Column(db.DateTime)
-    fecha_inicio = db.Column(db.Date)  # Fecha de inicio del plan
-    fecha_fin = db.Column(db.Date)  # Fecha de vencimiento (si aplica)
-    
-    # Control de consultas
-    consultas_consumidas = db.Column(db.Integer, default=0)
-    consultas_disponibles = db.Column(db.Integer)  # Se calcula al aprobar
-    
-    # Comprobante de solicitud inicial
-    comprobante_inicial = db.Column(db.LargeBinary)
-    comprobante_inicial_nombre = db.Column(db.String(255))
-    comprobante_inicial_tipo = db.Column(db.String(100))
-    fecha_subida_inicial = db.Column(db.DateTime)
-    
-    # Observaciones
-    observaciones = db.Column(db.Text)
-    motivo_rechazo = db.Column(db.Text)
-    
-    # Auditoría
-    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    cancelado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    fecha_cancelacion = db.Column(db.DateTime)
-    
-    # Relaciones
-    usuario = db.relationship('Usuario', foreign_keys=[usuario_id], backref='suscripcion_prepaga')
-    plan = db.relationship('PlanPrepaga', back_populates='suscripciones')
-    pagos_mensuales = db.relationship('PagoMensualPrepaga', back_populates='suscripcion', lazy='dynamic')
-    
-    # Índices
-    __table_args__ = (
-        db.Index('idx_suscripcion_usuario_estado', 'usuario_id', 'estado'),
-    )
-    
-    def __repr__(self):
-        return f'<SuscripcionPrepaga U{self.usuario_id}-P{self.plan_id}>'
-    
-    def tiene_consultas_disponibles(self):
-        """Verifica si aún tiene consultas disponibles"""
-        if self.estado != EstadoSuscripcion.ACTIVA:
-            return False
-        return self.consultas_consumidas < self.consultas_disponibles
-    
-    def consumir_consulta(self):
-        """Consume una consulta del plan"""
-        if self.tiene_consultas_disponibles():
-            self.consultas_consumidas += 1
-            return True
-        return False
-    
-    def consultas_restantes(self):
-        """Retorna el número de consultas restantes"""
-        return max(0, self.consultas_disponibles - self.consultas_consumidas)
-
-
-class PagoMensualPrepaga(db.Model):
-    """
-    Pagos mensuales de una suscripción de prepaga
-    """
-    __tablename__ = 'pagos_mensuales_prepaga'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    suscripcion_id = db.Column(db.Integer, db.ForeignKey('suscripciones_prepaga.id'), nullable=False)
-    
-    # Periodo de pago
-    mes = db.Column(db.Integer, nullable=False)  # 1-12
-    anio = db.Column(db.Integer, nullable=False)
-    
-    # Monto
-    monto = db.Column(db.Numeric(10, 2), nullable=False)
-    
-    # Estado
-    estado = db.Column(db.Enum(EstadoPagoMensual), default=EstadoPagoMensual.PENDIENTE, nullable=False)
-    
-    # Comprobante
-    comprobante = db.Column(db.LargeBinary)
-    comprobante_nombre = db.Column(db.String(255))
-    comprobante_tipo = db.Column(db.String(100))
-    fecha_subida = db.Column(db.DateTime)
-    
-    # Fechas importantes
-    fecha_vencimiento = db.Column(db.Date, nullable=False)  # Fecha límite para pagar
-    fecha_aprobacion = db.Column(db.DateTime)
-    
-    # Auditoría
-    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
-    observaciones = db.Column(db.Text)
-    motivo_rechazo = db.Column(db.Text)
-    
-    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relaciones
-    suscripcion = db.relationship('SuscripcionPrepaga', back_populates='pagos_mensuales')
-    aprobador = db.relationship('Usuario', foreign_keys=[aprobado_por])
-    
-    # Índices
-    __table_args__ = (
-        db.UniqueConstraint('suscripcion_id', 'mes', 'anio', name='uq_pago_mensual'),
-        db.Index('idx_pago_mensual_estado', 'estado'),
-    )
-    
-    def __repr__(self):
-        return f'<PagoMensualPrepaga S{self.suscripcion_id}-{self.mes}/{self.anio}>'
-    
-    @property
-    def periodo_texto(self):
-        """Retorna el periodo en formato legible"""
-        meses = {
-            1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril',
-            5: 'Mayo', 6: 'Junio', 7: 'Julio', 8: 'Agosto',
-            9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-        }
-        return f"{meses.get(self.mes, '')} {self.anio}"
-
-
-class HistorialConsultasPrepaga(db.Model):
-    """
-    Historial de consumo de consultas de la prepaga
-    """
-    __tablename__ = 'historial_consultas_prepaga'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    suscripcion_id = db.Column(db.Integer, db.ForeignKey('suscripciones_prepaga.id'), nullable=False)
-    turno_id = db.Column(db.Integer, db.ForeignKey('turnos.id'), nullable=False)
-    
-    fecha_consumo = db.Column(db.DateTime, default=datetime.utcnow)
-    consultas_antes = db.Column(db.Integer)  # Consultas disponibles antes
-    consultas_despues = db.Column(db.Integer)  # Consultas disponibles después
-    
-    # Relaciones
-    suscripcion = db.relationship('SuscripcionPrepaga', backref='historial_consumo')
-    turno = db.relationship('Turno', backref='consumo_prepaga')
-    
-    def __repr__(self):
+from models import db
+from datetime import datetime, date
+from calendar import monthrange
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert as insert_pg
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.ext.hybrid import hybrid_property
+import enum
+
+# Nombres de meses indexados por número (el 0 queda vacío): tupla a nivel
+# módulo para no reconstruir el dict en cada acceso a periodo_texto
+_MESES = ('', 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+          'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre')
+
+# ==================== ENUMS ====================
+
+class TipoPlan(enum.Enum):
+    INDIVIDUAL = "individual"
+    PAREJA = "pareja"
+    FAMILIAR = "familiar"
+    FAMILIAR_MAXI = "familiar_maxi"
+
+class EstadoSuscripcion(enum.Enum):
+    PENDIENTE = "pendiente"  # Solicitud enviada, esperando aprobación
+    ACTIVA = "activa"  # Suscripción aprobada y activa
+    SUSPENDIDA = "suspendida"  # Suspendida por falta de pago
+    CANCELADA = "cancelada"  # Cancelada por el usuario o admin
+    VENCIDA = "vencida"  # Periodo vencido
+
+class EstadoPagoMensual(enum.Enum):
+    PENDIENTE = "pendiente"  # Comprobante subido, esperando revisión
+    APROBADO = "aprobado"  # Pago aprobado
+    RECHAZADO = "rechazado"  # Pago rechazado
+    VENCIDO = "vencido"  # No se subió comprobante a tiempo
+
+# ==================== MODELOS ====================
+
+class PlanPrepaga(db.Model):
+    """
+    Definición de los planes de prepaga disponibles
+    """
+    __tablename__ = 'planes_prepaga'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.Enum(TipoPlan, native_enum=False, length=20), nullable=False, unique=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    descripcion = db.Column(db.Text)
+    
+    # Costos y límites
+    precio_mensual = db.Column(db.Numeric(10, 2), nullable=False)
+    consultas_incluidas = db.Column(db.Integer, default=10)  # Por persona
+    personas_maximas = db.Column(db.Integer, default=1)  # 1=Individual, 2=Pareja, 4=Familiar, etc
+    
+    # Características especiales
+    incluye_medico_online = db.Column(db.Boolean, default=False)
+    
+    activo = db.Column(db.Boolean, default=True)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relaciones
+    # lazy default (select): 'dynamic' impedía eager-loadear la colección
+    suscripciones = db.relationship('SuscripcionPrepaga', back_populates='plan')
+    
+    def __repr__(self):
+        return f'<PlanPrepaga {self.nombre}>'
+
+
+class SuscripcionPrepaga(db.Model):
+    """
+    Suscripción de un usuario a un plan de prepaga
+    """
+    __tablename__ = 'suscripciones_prepaga'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    plan_id = db.Column(db.Integer, db.ForeignKey('planes_prepaga.id'), nullable=False)
+    
+    # Estado y fechas
+    estado = db.Column(db.Enum(EstadoSuscripcion, native_enum=False, length=20), default=EstadoSuscripcion.PENDIENTE, nullable=False)
+    fecha_solicitud = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_aprobacion = db.Column(db.DateTime)
+    fecha_inicio = db.Column(db.Date)  # Fecha de inicio del plan
+    fecha_fin = db.Column(db.Date)  # Fecha de vencimiento (si aplica)
+    
+    # Control de consultas
+    consultas_consumidas = db.Column(db.Integer, default=0)
+    consultas_disponibles = db.Column(db.Integer)  # Se calcula al aprobar
+    
+    # Comprobante de solicitud inicial
+    # Deferred como Pago.comprobante: los listados del admin no necesitan
+    # el blob y sin esto cada fila lo arrastraba entero
+    comprobante_inicial = db.deferred(db.Column(db.LargeBinary))
+    # Clave en el almacenamiento externo (ver almacenamiento.py); con
+    # clave presente el LargeBinary queda NULL
+    comprobante_inicial_clave = db.Column(db.String(64))
+    comprobante_inicial_nombre = db.Column(db.String(255))
+    comprobante_inicial_tipo = db.Column(db.String(100))
+    fecha_subida_inicial = db.Column(db.DateTime)
+    
+    # Observaciones
+    observaciones = db.Column(db.Text)
+    motivo_rechazo = db.Column(db.Text)
+    
+    # Auditoría
+    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    cancelado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    fecha_cancelacion = db.Column(db.DateTime)
+    
+    # Relaciones
+    usuario = db.relationship('Usuario', foreign_keys=[usuario_id], backref='suscripcion_prepaga')
+    # El plan se muestra en casi toda vista de suscripción: joined evita
+    # el SELECT extra por fila en los listados sin options explícitas
+    plan = db.relationship('PlanPrepaga', back_populates='suscripciones', lazy='joined')
+    pagos_mensuales = db.relationship('PagoMensualPrepaga', back_populates='suscripcion')
+    
+    # Índices
+    __table_args__ = (
+        db.Index('idx_suscripcion_usuario_estado', 'usuario_id', 'estado'),
+    )
+    
+    def __repr__(self):
+        return f'<SuscripcionPrepaga U{self.usuario_id}-P{self.plan_id}>'
+    
+    def tiene_consultas_disponibles(self):
+        """Verifica si aún tiene consultas disponibles"""
+        if self.estado != EstadoSuscripcion.ACTIVA:
+            return False
+        return self.consultas_consumidas < self.consultas_disponibles
+    
+    def consumir_consulta(self):
+        """Consume una consulta del plan"""
+        if self.tiene_consultas_disponibles():
+            self.consultas_consumidas += 1
+            return True
+        return False
+    
+    @hybrid_property
+    def consultas_restantes(self):
+        """Número de consultas restantes; como híbrida también compila a
+        SQL, así el filtro 'con cupo' corre en la base sin hidratar filas"""
+        return max(0, (self.consultas_disponibles or 0) - self.consultas_consumidas)
+
+    @consultas_restantes.expression
+    def consultas_restantes(cls):
+        return case(
+            (cls.consultas_disponibles > cls.consultas_consumidas,
+             cls.consultas_disponibles - cls.consultas_consumidas),
+            else_=0
+        )
+
+
+class PagoMensualPrepaga(db.Model):
+    """
+    Pagos mensuales de una suscripción de prepaga
+    """
+    __tablename__ = 'pagos_mensuales_prepaga'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    suscripcion_id = db.Column(db.Integer, db.ForeignKey('suscripciones_prepaga.id'), nullable=False)
+    
+    # Periodo de pago
+    mes = db.Column(db.Integer, nullable=False)  # 1-12
+    anio = db.Column(db.Integer, nullable=False)
+    
+    # Monto
+    monto = db.Column(db.Numeric(10, 2), nullable=False)
+    
+    # Estado
+    estado = db.Column(db.Enum(EstadoPagoMensual, native_enum=False, length=20), default=EstadoPagoMensual.PENDIENTE, nullable=False)
+    
+    # Comprobante
+    comprobante = db.deferred(db.Column(db.LargeBinary))
+    # Clave en el almacenamiento externo (ver almacenamiento.py)
+    comprobante_clave = db.Column(db.String(64))
+    comprobante_nombre = db.Column(db.String(255))
+    comprobante_tipo = db.Column(db.String(100))
+    fecha_subida = db.Column(db.DateTime)
+    
+    # Fechas importantes
+    fecha_vencimiento = db.Column(db.Date, nullable=False)  # Fecha límite para pagar
+    fecha_aprobacion = db.Column(db.DateTime)
+    
+    # Auditoría
+    aprobado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    observaciones = db.Column(db.Text)
+    motivo_rechazo = db.Column(db.Text)
+    
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relaciones
+    suscripcion = db.relationship('SuscripcionPrepaga', back_populates='pagos_mensuales', lazy='joined')
+    aprobador = db.relationship('Usuario', foreign_keys=[aprobado_por])
+    
+    # Índices
+    __table_args__ = (
+        db.UniqueConstraint('suscripcion_id', 'mes', 'anio', name='uq_pago_mensual'),
+        db.Index('idx_pago_mensual_estado', 'estado'),
+        # Historial de pagos de una suscripción en orden cronológico.
+        # El UNIQUE de arriba ordena por mes antes que anio, así que no
+        # sirve para el rango; el INCLUDE hace que el listado salga como
+        # index-only scan en Postgres sin tocar el heap
+        db.Index(
+            'idx_pmp_sub_periodo',
+            'suscripcion_id', 'anio', 'mes',
+            postgresql_include=['estado', 'monto', 'fecha_vencimiento']
+        ),
+    )
+    
+    def __repr__(self):
+        return f'<PagoMensualPrepaga S{self.suscripcion_id}-{self.mes}/{self.anio}>'
+
+    @classmethod
+    def asegurar_para(cls, suscripcion, mes, anio):
+        """Garantiza que exista el pago del período para la suscripción.
+
+        INSERT .. ON CONFLICT DO NOTHING apoyado en uq_pago_mensual:
+        idempotente, y cierra la carrera si dos procesos generan el
+        mismo período a la vez (sqlite en dev usa su propia variante).
+        Vence el día 10 del período. No hace commit: lo decide el caller.
+        """
+        ultimo_dia = monthrange(anio, mes)[1]
+        insertar = insert_pg if db.engine.dialect.name == 'postgresql' else insert_sqlite
+        db.session.execute(
+            insertar(cls).values(
+                suscripcion_id=suscripcion.id,
+                mes=mes,
+                anio=anio,
+                monto=suscripcion.plan.precio_mensual,
+                fecha_vencimiento=date(anio, mes, min(10, ultimo_dia)),
+                estado=EstadoPagoMensual.PENDIENTE
+            ).on_conflict_do_nothing(index_elements=['suscripcion_id', 'mes', 'anio'])
+        )
+
+    @property
+    def periodo_texto(self):
+        """Retorna el periodo en formato legible"""
+        mes = _MESES[self.mes] if 1 <= self.mes <= 12 else ''
+        return f"{mes} {self.anio}"
+
+
+class HistorialConsultasPrepaga(db.Model):
+    """
+    Historial de consumo de consultas de la prepaga
+    """
+    __tablename__ = 'historial_consultas_prepaga'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    suscripcion_id = db.Column(db.Integer, db.ForeignKey('suscripciones_prepaga.id'), nullable=False)
+    turno_id = db.Column(db.Integer, db.ForeignKey('turnos.id'), nullable=False)
+    
+    fecha_consumo = db.Column(db.DateTime, default=datetime.utcnow)
+    consultas_antes = db.Column(db.Integer)  # Consultas disponibles antes
+    consultas_despues = db.Column(db.Integer)  # Consultas disponibles después
+    
+    # Relaciones
+    suscripcion = db.relationship('SuscripcionPrepaga', backref='historial_consumo')
+    turno = db.relationship('Turno', backref='consumo_prepaga')
+    
+    def __repr__(self):
         return f'<HistorialConsulta S{self.suscripcion_id}-T{self.turno_id}>'
\ No newline at end of file
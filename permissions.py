@@ -1,121 +1,209 @@
-from functools import wraps
-from flask import session, flash, redirect, url_for, request
-from models import Usuario, RolUsuario
-import json
-from datetime import datetime
-
-# ==================== DEFINICIÓN DE PERMISOS ====================
-
-PERMISOS = {
-    RolUsuario.ADMIN: {
-        'especialidades': ['crear', 'editar', 'eliminar', 'ver'],
-        'especialistas': ['crear', 'editar', 'eliminar', 'ver', 'horarios'],
-        'usuarios': ['crear', 'editar', 'eliminar', 'ver'],
-        'turnos': ['ver', 'modificar', 'cancelar', 'crear'],
-        'pagos': ['ver', 'aprobar', 'rechazar', 'marcar_abonado'],
-        'movimientos': ['ver', 'crear', 'modificar'],
-        'reportes': ['ver', 'exportar'],
-        'configuracion': ['ver', 'modificar'],
-    },
-    
-    RolUsuario.RECEPCION: {
-        'turnos': ['ver', 'crear'],
-        'pagos': ['ver', 'marcar_abonado'],
-        'pacientes': ['buscar', 'ver'],
-    },
-    
-    RolUsuario.ESPECIALISTA: {
-        'turnos': ['ver_propios', 'atender', 'observaciones'],
-        'pacientes': ['ver_asignados'],
-    },
-    
-    RolUsuario.PACIENTE: {
-        'turnos': ['crear', 'ver_propios', 'cancelar_propios'],
-        'pagos': ['ver_propios', 'subir_comprobante'],
-        'historial': ['ver_propio'],
-    }
-}
-
-# ==================== DECORADORES ====================
-
-def permission_required(*permisos_requeridos):
-    """
-    Decorador para verificar permisos específicos
-    
-    Uso:
-        @permission_required('especialidades:crear', 'especialidades:editar')
-        def crear_especialidad():
-            pass
-    """
-    def decorator(f):
-        @wraps(f)
-        def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                flash('Debe iniciar sesión', 'warning')
-                return redirect(url_for('login'))
-            
-            usuario = Usuario.query.get(session['user_id'])
-            if not usuario:
-                flash('Usuario no encontrado', 'danger')
-                return redirect(url_for('login'))
-            
-            # Verificar cada permiso
-            tiene_permiso = False
-            permisos_usuario = PERMISOS.get(usuario.rol, {})
-            
-            for permiso in permisos_requeridos:
-                if ':' in permiso:
-                    recurso, accion = permiso.split(':')
-                    if recurso in permisos_usuario and accion in permisos_usuario[recurso]:
-                        tiene_permiso = True
-                        break
-            
-            if not tiene_permiso:
-                flash('No tiene permisos para realizar esta acción', 'danger')
-                return redirect(url_for('dashboard_admin' if usuario.rol in [RolUsuario.ADMIN, RolUsuario.RECEPCION] else 'dashboard_user'))
-            
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
-
-def admin_only(f):
-    """Decorador simplificado para acciones exclusivas de admin"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Debe iniciar sesión', 'warning')
-            return redirect(url_for('login'))
-        
-        usuario = Usuario.query.get(session['user_id'])
-        if not usuario or usuario.rol != RolUsuario.ADMIN:
-            flash('Acceso denegado. Solo administradores.', 'danger')
-            return redirect(url_for('index'))
-        
-        return f(*args, **kwargs)
-    return decorated_function
-
-
-def log_admin_action(accion, tabla=None, registro_id=None, datos_anteriores=None, datos_nuevos=None):
-    """
-    Registra una acción administrativa en la auditoría
-    """
-    from models_admin import AuditoriaAdmin
-    from models import db
-    
-    if 'user_id' not in session:
-        return
-    
-    auditoria = AuditoriaAdmin(
-        usuario_id=session['user_id'],
-        accion=accion,
-        tabla_afectada=tabla,
-        registro_id=registro_id,
-        datos_anteriores=datos_anteriores,
-        datos_nuevos=datos_nuevos,
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', '')[:255]
-    )
-    
-    db.session.add(auditoria)
-    db.session.commit()
\ No newline at end of file
+from functools import wraps
+from flask import g, session, flash, redirect, url_for, request
+from models import db, Usuario, RolUsuario
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+# ==================== DEFINICIÓN DE PERMISOS ====================
+
+PERMISOS = {
+    RolUsuario.ADMIN: {
+        'especialidades': ['crear', 'editar', 'eliminar', 'ver'],
+        'especialistas': ['crear', 'editar', 'eliminar', 'ver', 'horarios'],
+        'usuarios': ['crear', 'editar', 'eliminar', 'ver'],
+        'turnos': ['ver', 'modificar', 'cancelar', 'crear'],
+        'pagos': ['ver', 'aprobar', 'rechazar', 'marcar_abonado'],
+        'movimientos': ['ver', 'crear', 'modificar'],
+        'reportes': ['ver', 'exportar'],
+        'configuracion': ['ver', 'modificar'],
+    },
+    
+    RolUsuario.RECEPCION: {
+        'turnos': ['ver', 'crear'],
+        'pagos': ['ver', 'marcar_abonado'],
+        'pacientes': ['buscar', 'ver'],
+    },
+    
+    RolUsuario.ESPECIALISTA: {
+        'turnos': ['ver_propios', 'atender', 'observaciones'],
+        'pacientes': ['ver_asignados'],
+    },
+    
+    RolUsuario.PACIENTE: {
+        'turnos': ['crear', 'ver_propios', 'cancelar_propios'],
+        'pagos': ['ver_propios', 'subir_comprobante'],
+        'historial': ['ver_propio'],
+    }
+}
+
+# Versión aplanada para el chequeo caliente: un frozenset de pares
+# (recurso, accion) por rol convierte la verificación en un lookup de
+# hash, sin split de strings ni scans de listas por request
+PERMISOS_SET = {
+    rol: frozenset(
+        (recurso, accion)
+        for recurso, acciones in recursos.items()
+        for accion in acciones
+    )
+    for rol, recursos in PERMISOS.items()
+}
+
+_SIN_PERMISOS = frozenset()
+
+# Dashboard al que se redirige cada rol cuando se le niega un acceso
+_ROL_DASHBOARD = {
+    RolUsuario.ADMIN: 'dashboard_admin',
+    RolUsuario.RECEPCION: 'dashboard_admin',
+    RolUsuario.ESPECIALISTA: 'dashboard_user',
+    RolUsuario.PACIENTE: 'dashboard_user',
+}
+
+# ==================== DECORADORES ====================
+
+def _usuario_actual():
+    """Usuario de la sesión, memoizado en g para el resto del request.
+
+    Con decoradores apilados o varios chequeos en la misma vista el
+    SELECT se emite una sola vez; session.get además resuelve por
+    identity map si el objeto ya está cargado.
+    """
+    usuario = getattr(g, '_usuario_actual', None)
+    if usuario is None:
+        usuario = db.session.get(Usuario, session['user_id'])
+        g._usuario_actual = usuario
+    return usuario
+
+
+def permission_required(*permisos_requeridos):
+    """
+    Decorador para verificar permisos específicos
+    
+    Uso:
+        @permission_required('especialidades:crear', 'especialidades:editar')
+        def crear_especialidad():
+            pass
+    """
+    # Los permisos pedidos se parsean una sola vez al decorar; en el
+    # request queda solo la intersección de sets
+    pares_requeridos = frozenset(
+        tuple(permiso.split(':')) for permiso in permisos_requeridos
+        if ':' in permiso
+    )
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                flash('Debe iniciar sesión', 'warning')
+                return redirect(url_for('login'))
+            
+            usuario = _usuario_actual()
+            if not usuario:
+                flash('Usuario no encontrado', 'danger')
+                return redirect(url_for('login'))
+            
+            permisos_usuario = PERMISOS_SET.get(usuario.rol, _SIN_PERMISOS)
+
+            if not (pares_requeridos & permisos_usuario):
+                flash('No tiene permisos para realizar esta acción', 'danger')
+                return redirect(url_for(_ROL_DASHBOARD.get(usuario.rol, 'index')))
+            
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def admin_only(f):
+    """Decorador simplificado para acciones exclusivas de admin"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Debe iniciar sesión', 'warning')
+            return redirect(url_for('login'))
+        
+        usuario = _usuario_actual()
+        if not usuario or usuario.rol != RolUsuario.ADMIN:
+            flash('Acceso denegado. Solo administradores.', 'danger')
+            return redirect(url_for('index'))
+        
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# ==================== AUDITORÍA ASINCRÓNICA ====================
+
+# La auditoría se encola y un hilo de fondo la persiste en lotes, así los
+# handlers de mutación no pagan un COMMIT extra en el camino crítico.
+# Ajustables por deployment: lotes más grandes amortizan mejor el fsync,
+# esperas más cortas acotan la ventana de pérdida ante un crash.
+AUDIT_BATCH_MAX = int(os.environ.get('AUDIT_BATCH_MAX', 50))
+AUDIT_BATCH_ESPERA = float(os.environ.get('AUDIT_BATCH_ESPERA', 2.0))
+
+_audit_queue = queue.Queue()
+_audit_worker = None
+
+
+def iniciar_audit_worker(app):
+    """Arranca (una sola vez) el hilo que persiste la auditoría en lotes"""
+    global _audit_worker
+    if _audit_worker is not None:
+        return
+    _audit_worker = threading.Thread(
+        target=_drenar_audit_queue,
+        args=(app,),
+        daemon=True,
+        name='audit-worker'
+    )
+    _audit_worker.start()
+
+
+def _drenar_audit_queue(app):
+    """Loop del worker: acumula hasta AUDIT_BATCH_MAX entradas o
+    AUDIT_BATCH_ESPERA segundos y las inserta en una sola transacción"""
+    from models_admin import AuditoriaAdmin
+    from models import db
+
+    while True:
+        lote = [_audit_queue.get()]
+        limite = time.monotonic() + AUDIT_BATCH_ESPERA
+
+        while len(lote) < AUDIT_BATCH_MAX:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(_audit_queue.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        with app.app_context():
+            try:
+                db.session.bulk_insert_mappings(AuditoriaAdmin, lote)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+
+def log_admin_action(accion, tabla=None, registro_id=None, datos_anteriores=None, datos_nuevos=None):
+    """
+    Registra una acción administrativa en la auditoría.
+    La escritura es asincrónica: se encola y el worker la persiste en lote.
+    """
+    if 'user_id' not in session:
+        return
+
+    _audit_queue.put({
+        'usuario_id': session['user_id'],
+        'accion': accion,
+        'tabla_afectada': tabla,
+        'registro_id': registro_id,
+        'datos_anteriores': datos_anteriores,
+        'datos_nuevos': datos_nuevos,
+        'ip_address': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent', '')[:255],
+        'fecha': datetime.utcnow(),
+    })
\ No newline at end of file
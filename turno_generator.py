@@ -1,206 +1,281 @@
-from datetime import datetime, date, timedelta, time
-from models import Turno, EstadoTurno, db
-from models_admin import (
-    HorarioAtencion, 
-    ConfiguracionEspecialista, 
-    BloqueoHorario,
-    EspecialistaEspecialidad
-)
-from sqlalchemy import and_
-
-class GeneradorTurnos:
-    """
-    Generador automático de slots de turnos
-    """
-    
-    @staticmethod
-    def obtener_slots_disponibles(especialista_id, especialidad_id, fecha):
-        """
-        Obtiene todos los slots disponibles para un especialista en una fecha
-        
-        Args:
-            especialista_id (int): ID del especialista
-            especialidad_id (int): ID de la especialidad
-            fecha (date): Fecha para buscar disponibilidad
-            
-        Returns:
-            list: Lista de diccionarios con información de cada slot
-        """
-        dia_semana = fecha.weekday()
-        
-        # 1. Verificar que el especialista atiende ese día
-        horarios = HorarioAtencion.query.filter(
-            HorarioAtencion.especialista_id == especialista_id,
-            HorarioAtencion.especialidad_id == especialidad_id,
-            HorarioAtencion.dia_semana == dia_semana,
-            HorarioAtencion.activo == True
-        ).all()
-        
-        if not horarios:
-            return []
-        
-        # 2. Verificar bloqueos
-        bloqueos = BloqueoHorario.query.filter(
-            BloqueoHorario.especialista_id == especialista_id,
-            BloqueoHorario.fecha_inicio <= fecha,
-            BloqueoHorario.fecha_fin >= fecha,
-            BloqueoHorario.activo == True
-        ).all()
-        
-        # 3. Obtener configuración del especialista
-        config = ConfiguracionEspecialista.query.filter_by(
-            especialista_id=especialista_id
-        ).first()
-        
-        if not config:
-            return []
-        
-        # 4. Verificar cupo máximo diario
-        turnos_del_dia = Turno.query.filter(
-            Turno.especialista_id == especialista_id,
-            Turno.fecha == fecha,
-            Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-        ).count()
-        
-        if turnos_del_dia >= config.pacientes_maximos_dia:
-            if not config.permite_sobreturnos:
-                return []
-        
-        # 5. Generar todos los slots posibles
-        todos_slots = []
-        for horario in horarios:
-            slots = horario.generar_slots(fecha)
-            for hora_inicio, hora_fin in slots:
-                # Verificar si el slot está bloqueado
-                bloqueado = False
-                for bloqueo in bloqueos:
-                    if bloqueo.hora_inicio and bloqueo.hora_fin:
-                        if (hora_inicio >= bloqueo.hora_inicio and 
-                            hora_inicio < bloqueo.hora_fin):
-                            bloqueado = True
-                            break
-                    else:
-                        # Bloqueo de día completo
-                        bloqueado = True
-                        break
-                
-                if not bloqueado:
-                    # Verificar si ya existe un turno en ese horario
-                    turno_existente = Turno.query.filter(
-                        Turno.especialista_id == especialista_id,
-                        Turno.fecha == fecha,
-                        Turno.hora == hora_inicio,
-                        Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-                    ).first()
-                    
-                    todos_slots.append({
-                        'hora_inicio': hora_inicio,
-                        'hora_fin': hora_fin,
-                        'disponible': turno_existente is None,
-                        'turno_id': turno_existente.id if turno_existente else None
-                    })
-        
-        return todos_slots
-    
-    @staticmethod
-    def obtener_proximas_fechas_disponibles(especialista_id, especialidad_id, dias_adelante=30):
-        """
-        Obtiene las próximas fechas con al menos un turno disponible
-        
-        Args:
-            especialista_id (int): ID del especialista
-            especialidad_id (int): ID de la especialidad
-            dias_adelante (int): Cantidad de días a futuro a verificar
-            
-        Returns:
-            list: Lista de fechas con disponibilidad
-        """
-        fechas_disponibles = []
-        fecha_actual = date.today()
-        
-        for i in range(dias_adelante):
-            fecha = fecha_actual + timedelta(days=i)
-            slots = GeneradorTurnos.obtener_slots_disponibles(
-                especialista_id, 
-                especialidad_id, 
-                fecha
-            )
-            
-            # Si hay al menos un slot disponible
-            if any(slot['disponible'] for slot in slots):
-                fechas_disponibles.append({
-                    'fecha': fecha,
-                    'dia_semana': fecha.weekday(),
-                    'slots_disponibles': sum(1 for s in slots if s['disponible']),
-                    'slots_totales': len(slots)
-                })
-        
-        return fechas_disponibles
-    
-    @staticmethod
-    def validar_turno(especialista_id, especialidad_id, fecha, hora):
-        """
-        Valida si se puede crear un turno en el horario especificado
-        
-        Returns:
-            tuple: (es_valido: bool, mensaje: str)
-        """
-        # 1. Verificar que el especialista atiende ese día y horario
-        dia_semana = fecha.weekday()
-        
-        horario = HorarioAtencion.query.filter(
-            HorarioAtencion.especialista_id == especialista_id,
-            HorarioAtencion.especialidad_id == especialidad_id,
-            HorarioAtencion.dia_semana == dia_semana,
-            HorarioAtencion.hora_inicio <= hora,
-            HorarioAtencion.hora_fin > hora,
-            HorarioAtencion.activo == True
-        ).first()
-        
-        if not horario:
-            return False, "El especialista no atiende en ese horario"
-        
-        # 2. Verificar bloqueos
-        bloqueo = BloqueoHorario.query.filter(
-            BloqueoHorario.especialista_id == especialista_id,
-            BloqueoHorario.fecha_inicio <= fecha,
-            BloqueoHorario.fecha_fin >= fecha,
-            BloqueoHorario.activo == True
-        ).first()
-        
-        if bloqueo:
-            if not bloqueo.hora_inicio:  # Bloqueo de día completo
-                return False, f"Horario bloqueado: {bloqueo.motivo}"
-            elif bloqueo.hora_inicio <= hora < bloqueo.hora_fin:
-                return False, f"Horario bloqueado: {bloqueo.motivo}"
-        
-        # 3. Verificar turno existente
-        turno_existente = Turno.query.filter(
-            Turno.especialista_id == especialista_id,
-            Turno.fecha == fecha,
-            Turno.hora == hora,
-            Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-        ).first()
-        
-        if turno_existente:
-            return False, "Ya existe un turno en ese horario"
-        
-        # 4. Verificar cupo máximo diario
-        config = ConfiguracionEspecialista.query.filter_by(
-            especialista_id=especialista_id
-        ).first()
-        
-        if config:
-            turnos_del_dia = Turno.query.filter(
-                Turno.especialista_id == especialista_id,
-                Turno.fecha == fecha,
-                Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
-            ).count()
-            
-            if turnos_del_dia >= config.pacientes_maximos_dia:
-                if not config.permite_sobreturnos:
-                    return False, "Cupo máximo diario alcanzado"
-                elif turnos_del_dia >= config.pacientes_maximos_dia + config.sobreturnos_maximos:
-                    return False, "Cupo máximo de sobreturnos alcanzado"
-        
+from collections import defaultdict
+from datetime import datetime, date, timedelta, time
+from models import Turno, EstadoTurno, db
+from models_admin import (
+    HorarioAtencion, 
+    ConfiguracionEspecialista, 
+    BloqueoHorario,
+    EspecialistaEspecialidad
+)
+from sqlalchemy import and_
+from cache_utils import cache
+
+# La config de turnos de un especialista cambia solo cuando el admin lo
+# edita: se cachean los tres escalares que usa la validación de cupo
+_TTL_CONFIG_ESPECIALISTA = 300
+
+
+def _config_especialista(especialista_id):
+    """Cupo y sobreturnos del especialista, cacheados por TTL.
+
+    Devuelve la fila (pacientes_maximos_dia, permite_sobreturnos,
+    sobreturnos_maximos) o None si no tiene configuración. El admin
+    invalida el prefijo 'config_esp:{id}:' al editar.
+    """
+    clave = f'config_esp:{especialista_id}:cupo'
+    valor = cache.obtener(clave)
+    if valor is None:
+        fila = db.session.query(
+            ConfiguracionEspecialista.pacientes_maximos_dia,
+            ConfiguracionEspecialista.permite_sobreturnos,
+            ConfiguracionEspecialista.sobreturnos_maximos
+        ).filter_by(especialista_id=especialista_id).first()
+        # False distingue "no tiene config" de "no estaba cacheado"
+        valor = fila if fila is not None else False
+        cache.guardar(clave, valor, _TTL_CONFIG_ESPECIALISTA)
+    return valor or None
+
+
+class GeneradorTurnos:
+    """
+    Generador automático de slots de turnos
+    """
+    
+    @staticmethod
+    def _precargar(especialista_id, especialidad_id, fecha_ini, fecha_fin):
+        """
+        Precarga en cuatro consultas todo lo que necesita el cálculo de
+        slots para un rango de fechas, para no repetirlas por día
+        
+        Args:
+            especialista_id (int): ID del especialista
+            especialidad_id (int): ID de la especialidad
+            fecha_ini (date): Inicio del rango (inclusive)
+            fecha_fin (date): Fin del rango (inclusive)
+            
+        Returns:
+            dict: horarios agrupados por día de semana, bloqueos que
+            tocan el rango, config del especialista y turnos vivos
+            agrupados por fecha (dict hora -> id)
+        """
+        horarios_por_dia = defaultdict(list)
+        for horario in HorarioAtencion.query.filter(
+            HorarioAtencion.especialista_id == especialista_id,
+            HorarioAtencion.especialidad_id == especialidad_id,
+            HorarioAtencion.activo == True
+        ).all():
+            horarios_por_dia[horario.dia_semana].append(horario)
+        
+        bloqueos = BloqueoHorario.query.filter(
+            BloqueoHorario.especialista_id == especialista_id,
+            BloqueoHorario.fecha_inicio <= fecha_fin,
+            BloqueoHorario.fecha_fin >= fecha_ini,
+            BloqueoHorario.activo == True
+        ).all()
+        
+        config = _config_especialista(especialista_id)
+        
+        ocupados_por_fecha = defaultdict(dict)
+        for t_fecha, t_hora, t_id in db.session.query(
+            Turno.fecha, Turno.hora, Turno.id
+        ).filter(
+            Turno.especialista_id == especialista_id,
+            Turno.fecha.between(fecha_ini, fecha_fin),
+            Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+        ).all():
+            ocupados_por_fecha[t_fecha][t_hora] = t_id
+        
+        return {
+            'horarios_por_dia': horarios_por_dia,
+            'bloqueos': bloqueos,
+            'config': config,
+            'ocupados_por_fecha': ocupados_por_fecha,
+        }
+    
+    @staticmethod
+    def obtener_slots_disponibles(especialista_id, especialidad_id, fecha, contexto=None):
+        """
+        Obtiene todos los slots disponibles para un especialista en una fecha
+        
+        Args:
+            especialista_id (int): ID del especialista
+            especialidad_id (int): ID de la especialidad
+            fecha (date): Fecha para buscar disponibilidad
+            contexto (dict): Datos precargados por _precargar; si falta,
+                se precarga solo esta fecha
+            
+        Returns:
+            list: Lista de diccionarios con información de cada slot
+        """
+        if contexto is None:
+            contexto = GeneradorTurnos._precargar(
+                especialista_id, especialidad_id, fecha, fecha
+            )
+        
+        dia_semana = fecha.weekday()
+        
+        # 1. Verificar que el especialista atiende ese día
+        horarios = contexto['horarios_por_dia'].get(dia_semana)
+        
+        if not horarios:
+            return []
+        
+        # 2. Bloqueos que caen sobre esta fecha
+        bloqueos = [
+            b for b in contexto['bloqueos']
+            if b.fecha_inicio <= fecha <= b.fecha_fin
+        ]
+        
+        # 3. Configuración del especialista
+        config = contexto['config']
+        
+        if not config:
+            return []
+        
+        # 4. Turnos vivos del día: el dict hora->id reemplaza el SELECT
+        # por slot del paso 5 y su largo sirve de contador de cupo
+        ocupados = contexto['ocupados_por_fecha'].get(fecha, {})
+        
+        if len(ocupados) >= config.pacientes_maximos_dia:
+            if not config.permite_sobreturnos:
+                return []
+        
+        # 5. Generar todos los slots posibles. Los bloqueos se resuelven
+        # una sola vez antes del loop: el día completo corta acá y los
+        # parciales quedan como tuplas planas (sin releer atributos ORM
+        # por cada slot). Sin ambas horas cuenta como día completo (el
+        # formulario admin permite cargar una sola)
+        if any(not b.hora_inicio or not b.hora_fin for b in bloqueos):
+            return []
+
+        intervalos_bloqueados = [(b.hora_inicio, b.hora_fin) for b in bloqueos]
+        
+        todos_slots = []
+        for horario in horarios:
+            slots = horario.generar_slots(fecha)
+            for hora_inicio, hora_fin in slots:
+                if any(ini <= hora_inicio < fin for ini, fin in intervalos_bloqueados):
+                    continue
+                
+                # Turno existente: lookup O(1) sobre el dict precargado
+                turno_id = ocupados.get(hora_inicio)
+                
+                todos_slots.append({
+                    'hora_inicio': hora_inicio,
+                    'hora_fin': hora_fin,
+                    'disponible': turno_id is None,
+                    'turno_id': turno_id
+                })
+        
+        return todos_slots
+    
+    @staticmethod
+    def obtener_proximas_fechas_disponibles(especialista_id, especialidad_id, dias_adelante=30):
+        """
+        Obtiene las próximas fechas con al menos un turno disponible
+        
+        Args:
+            especialista_id (int): ID del especialista
+            especialidad_id (int): ID de la especialidad
+            dias_adelante (int): Cantidad de días a futuro a verificar
+            
+        Returns:
+            list: Lista de fechas con disponibilidad
+        """
+        fechas_disponibles = []
+        fecha_actual = date.today()
+        
+        # Una sola precarga para toda la ventana: antes cada día repetía
+        # sus cuatro consultas (~120 round trips en 30 días)
+        contexto = GeneradorTurnos._precargar(
+            especialista_id,
+            especialidad_id,
+            fecha_actual,
+            fecha_actual + timedelta(days=dias_adelante - 1)
+        )
+        
+        for i in range(dias_adelante):
+            fecha = fecha_actual + timedelta(days=i)
+            slots = GeneradorTurnos.obtener_slots_disponibles(
+                especialista_id, 
+                especialidad_id, 
+                fecha,
+                contexto=contexto
+            )
+            
+            # Si hay al menos un slot disponible
+            if any(slot['disponible'] for slot in slots):
+                fechas_disponibles.append({
+                    'fecha': fecha,
+                    'dia_semana': fecha.weekday(),
+                    'slots_disponibles': sum(1 for s in slots if s['disponible']),
+                    'slots_totales': len(slots)
+                })
+        
+        return fechas_disponibles
+    
+    @staticmethod
+    def validar_turno(especialista_id, especialidad_id, fecha, hora):
+        """
+        Valida si se puede crear un turno en el horario especificado
+        
+        Returns:
+            tuple: (es_valido: bool, mensaje: str)
+        """
+        # 1. Verificar que el especialista atiende ese día y horario
+        dia_semana = fecha.weekday()
+        
+        horario = HorarioAtencion.query.filter(
+            HorarioAtencion.especialista_id == especialista_id,
+            HorarioAtencion.especialidad_id == especialidad_id,
+            HorarioAtencion.dia_semana == dia_semana,
+            HorarioAtencion.hora_inicio <= hora,
+            HorarioAtencion.hora_fin > hora,
+            HorarioAtencion.activo == True
+        ).first()
+        
+        if not horario:
+            return False, "El especialista no atiende en ese horario"
+        
+        # 2. Verificar bloqueos
+        bloqueo = BloqueoHorario.query.filter(
+            BloqueoHorario.especialista_id == especialista_id,
+            BloqueoHorario.fecha_inicio <= fecha,
+            BloqueoHorario.fecha_fin >= fecha,
+            BloqueoHorario.activo == True
+        ).first()
+        
+        if bloqueo:
+            if not bloqueo.hora_inicio:  # Bloqueo de día completo
+                return False, f"Horario bloqueado: {bloqueo.motivo}"
+            elif bloqueo.hora_inicio <= hora < bloqueo.hora_fin:
+                return False, f"Horario bloqueado: {bloqueo.motivo}"
+        
+        # 3. Verificar turno existente
+        turno_existente = Turno.query.filter(
+            Turno.especialista_id == especialista_id,
+            Turno.fecha == fecha,
+            Turno.hora == hora,
+            Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+        ).first()
+        
+        if turno_existente:
+            return False, "Ya existe un turno en ese horario"
+        
+        # 4. Verificar cupo máximo diario (config cacheada por TTL)
+        config = _config_especialista(especialista_id)
+        
+        if config:
+            turnos_del_dia = Turno.query.filter(
+                Turno.especialista_id == especialista_id,
+                Turno.fecha == fecha,
+                Turno.estado.in_([EstadoTurno.PENDIENTE, EstadoTurno.CONFIRMADO])
+            ).count()
+            
+            if turnos_del_dia >= config.pacientes_maximos_dia:
+                if not config.permite_sobreturnos:
+                    return False, "Cupo máximo diario alcanzado"
+                elif turnos_del_dia >= config.pacientes_maximos_dia + config.sobreturnos_maximos:
+                    return False, "Cupo máximo de sobreturnos alcanzado"
+        
         return True, "Turno válido"
\ No newline at end of file